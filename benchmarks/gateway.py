@@ -0,0 +1,113 @@
+import argparse
+import http.client
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+# a stand-in for the OpenFaaS gateway: /function/<name>[/path][?query] is proxied to the function's own server
+FUNCTION_PREFIX = "/function/"
+FORWARDED_REQUEST_HEADERS = ("Content-Type", "Accept", "traceparent", "X-Request-Timeout")
+FORWARDED_RESPONSE_HEADERS = ("Content-Type", "Server-Timing", "Retry-After")
+UPSTREAM_TIMEOUT = 120
+
+def make_gateway_handler(routes: Dict[str, str]) -> type:
+    # routes are looked up on every request, so functions can be added or moved while the gateway runs
+    # one keep-alive connection per gateway thread and upstream, like the gateway's pooled transport
+    connections = threading.local()
+
+    def connection(url: str) -> http.client.HTTPConnection:
+        pool = connections.__dict__.setdefault("pool", {})
+        if url not in pool:
+            upstream = urlparse(url)
+            pool[url] = http.client.HTTPConnection(upstream.hostname, upstream.port, timeout=UPSTREAM_TIMEOUT)
+        return pool[url]
+
+    class GatewayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # like the functions' servers, a response body must not wait for the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.proxy()
+
+        do_POST = do_PUT = do_GET
+
+        def route(self) -> Tuple[str, str]:
+            if not self.path.startswith(FUNCTION_PREFIX):
+                return "", ""
+            name, _, rest = self.path[len(FUNCTION_PREFIX):].partition("/")
+            if "?" in name:
+                name, query = name.split("?", 1)
+                rest = "/?" + query
+            elif rest:
+                rest = "/" + rest
+            return name, rest or "/"
+
+        def proxy(self):
+            name, path = self.route()
+            url = routes.get(name)
+            if url is None:
+                self.respond(404, f"No such function: {name}".encode('utf-8'), {"Content-Type": "text/plain"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else None
+            headers = {header: self.headers[header] for header in FORWARDED_REQUEST_HEADERS if header in self.headers}
+            try:
+                response = self.forward(url, path, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                self.respond(502, f"Function {name} unreachable: {e}".encode('utf-8'), {"Content-Type": "text/plain"})
+                return
+            self.respond(response[0], response[1], response[2])
+
+        def forward(self, url: str, path: str, body, headers: Dict[str, str]) -> Tuple[int, bytes, Dict[str, str]]:
+            for attempt in range(2):
+                upstream = connection(url)
+                try:
+                    upstream.request(self.command, urlparse(url).path.rstrip("/") + path, body=body, headers=headers)
+                    response = upstream.getresponse()
+                    return response.status, response.read(), {
+                        header: response.headers[header] for header in FORWARDED_RESPONSE_HEADERS if header in response.headers
+                    }
+                except (OSError, http.client.HTTPException):
+                    # a keep-alive connection closed by the function is reopened once
+                    upstream.close()
+                    if attempt:
+                        raise
+
+        def respond(self, status: int, body: bytes, headers: Dict[str, str]):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return GatewayHandler
+
+def start_gateway(routes: Dict[str, str], port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_gateway_handler(routes))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenFaaS gateway")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--route", action="append", default=[], metavar="NAME=URL",
+                        help="e.g. face-detection=http://127.0.0.1:5001, can be repeated")
+    args = parser.parse_args()
+
+    routes = dict(route.split("=", 1) for route in args.route)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_gateway_handler(routes))
+    print(f"Gateway on http://127.0.0.1:{args.port}, routing {', '.join(routes) or 'nothing'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gateway import start_gateway  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_WORKLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workload.jsonl")
+
+FACE_FUNCTIONS = ["face-detection", "face-gender-detection", "face-emotion-detection"]
+# every function runs from its own directory, like the container WORKDIR, so the default model paths resolve
+TARGETS: Dict[str, Dict[str, Any]] = {
+    "face-detection": {"path": "functions/face-detection", "input": "image"},
+    "face-gender-detection": {"path": "functions/face-gender-detection", "input": "faces"},
+    "face-emotion-detection": {"path": "functions/face-emotion-detection", "input": "faces"},
+    "sentiment-analysis": {"path": "functions/sentiment-analysis", "input": "text"},
+    "multi-label-sentiment-analysis": {"path": "functions/multi-label-sentiment-analysis", "input": "text"},
+    "text-classification": {"path": "functions/text-classification", "input": "text"},
+    "face-analysis-orchestrator": {"path": "workflows/face-analysis-orchestrator", "input": "raw-image",
+                                   "depends": FACE_FUNCTIONS, "env": {"REDIS_HOST": "127.0.0.1"}},
+    "face-analysis-fused": {"path": "workflows/face-analysis-orchestrator", "input": "raw-image",
+                            "env": {"PIPELINE_MODE": "fused", "REDIS_HOST": "127.0.0.1"}},
+}
+
+WORDS = (
+    "the a this that it was is be not very really quite so too and but or because while after before "
+    "i you we they he she people team company market government city game season player price report "
+    "movie food service phone update deal game match result plan week year today yesterday tomorrow "
+    "love hate like enjoy fear worry hope trust miss want need feel think know say see find "
+    "good great amazing awful terrible bad happy sad angry afraid surprised proud calm excited boring "
+    "new old big small fast slow early late high low strong weak first last best worst free fair "
+    "stocks shares profit loss growth crash rally election vote minister war peace talks storm "
+    "science research space nasa launch software chip network security data model study cure"
+).split()
+
+READY_TIMEOUT = 180
+REQUEST_TIMEOUT = 120
+
+# workload
+
+def load_workload(path: str, names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        scenarios = [json.loads(line) for line in f if line.strip() and not line.lstrip().startswith("#")]
+    for scenario in scenarios:
+        if scenario.get("function") not in TARGETS:
+            raise ValueError(f"Scenario {scenario.get('name')}: unknown function {scenario.get('function')}")
+    return [scenario for scenario in scenarios if not names or scenario["name"] in names]
+
+def sample_lengths(spec: str, count: int, rng: np.random.Generator) -> np.ndarray:
+    # "fixed:N", "uniform:MIN-MAX" or "lognormal:MEDIAN,SIGMA", in words
+    kind, _, params = spec.partition(":")
+    if kind == "fixed":
+        lengths = np.full(count, int(params))
+    elif kind == "uniform":
+        low, high = (int(value) for value in params.split("-"))
+        lengths = rng.integers(low, high + 1, count)
+    elif kind == "lognormal":
+        median, sigma = (float(value) for value in params.split(","))
+        lengths = np.rint(rng.lognormal(math.log(median), sigma, count))
+    else:
+        raise ValueError(f"Unknown length distribution: {spec}")
+    return np.maximum(lengths, 1).astype(int)
+
+def make_texts(spec: str, count: int, rng: np.random.Generator) -> List[str]:
+    return [" ".join(rng.choice(WORDS, length)) for length in sample_lengths(spec, count, rng)]
+
+def draw_face(canvas: np.ndarray, cx: int, cy: int, size: int, rng: np.random.Generator):
+    skin = tuple(int(c) for c in rng.integers([90, 120, 170], [140, 180, 235]))
+    hair = tuple(int(c) for c in rng.integers(10, 90, 3))
+    half_w, half_h = int(size * 0.38), int(size * 0.5)
+    cv2.ellipse(canvas, (cx, cy - half_h // 4), (half_w + size // 20, half_h), 0, 180, 360, hair, -1)
+    cv2.ellipse(canvas, (cx, cy), (half_w, half_h), 0, 0, 360, skin, -1)
+    for side in (-1, 1):
+        eye = (cx + side * half_w // 2, cy - half_h // 5)
+        cv2.ellipse(canvas, eye, (size // 11, size // 22), 0, 0, 360, (245, 245, 245), -1)
+        cv2.circle(canvas, eye, max(size // 28, 1), (40, 30, 20), -1)
+        cv2.line(canvas, (eye[0] - size // 10, eye[1] - size // 9), (eye[0] + size // 10, eye[1] - size // 8), hair, max(size // 40, 1))
+    cv2.line(canvas, (cx, cy - half_h // 8), (cx - size // 24, cy + half_h // 5), tuple(c - 40 for c in skin), max(size // 60, 1))
+    cv2.ellipse(canvas, (cx, cy + half_h // 2), (size // 6, size // 14), 0, 10, 170, (60, 60, 150), max(size // 40, 1))
+
+def make_image(width: int, height: int, faces: int, rng: np.random.Generator, face_image: Optional[np.ndarray] = None) -> np.ndarray:
+    # faces are laid out on a grid over a noisy gradient, each one a fresh draw so no two images hash the same
+    gradient = np.linspace(60, 200, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    image = np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    if not faces:
+        return image
+    cols = math.ceil(math.sqrt(faces * width / height))
+    rows = math.ceil(faces / cols)
+    cell_w, cell_h = width // cols, height // rows
+    size = int(min(cell_w, cell_h) * 0.7)
+    for i in range(faces):
+        cx, cy = (i % cols) * cell_w + cell_w // 2, (i // cols) * cell_h + cell_h // 2
+        if face_image is not None:
+            face = cv2.resize(face_image, (size, size))
+            image[cy - size // 2:cy - size // 2 + size, cx - size // 2:cx - size // 2 + size] = face
+        else:
+            draw_face(image, cx, cy, size, rng)
+    return image
+
+def encode_jpeg(image: np.ndarray) -> bytes:
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def make_payloads(scenario: Dict[str, Any], batch_size: int, concurrency: int, count: int, seed: int,
+                  face_image: Optional[np.ndarray] = None) -> List[bytes]:
+    # every request carries different content, also across levels, so result and stage caches do not turn the run into a cache benchmark
+    rng = np.random.default_rng([seed, batch_size, concurrency])
+    kind = TARGETS[scenario["function"]]["input"]
+    payloads = []
+    for _ in range(count):
+        if kind == "text":
+            texts = make_texts(scenario.get("words", "lognormal:16,0.6"), batch_size, rng)
+            message = {"text": texts[0]} if batch_size == 1 else {"texts": texts}
+            if "model" in scenario:
+                message["model"] = scenario["model"]
+        elif kind == "faces":
+            size = scenario.get("face_size", 96)
+            crops = [encode_jpeg(make_image(size, size, 1, rng, face_image)).hex() for _ in range(batch_size)]
+            message = {"faces": [{"face_id": i + 1, "confidence": 1.0, "face_image": crop} for i, crop in enumerate(crops)]}
+        else:
+            images = [encode_jpeg(make_image(scenario.get("width", 640), scenario.get("height", 480), scenario.get("faces", 1), rng, face_image))
+                      for _ in range(batch_size)]
+            if kind == "raw-image":
+                payloads.append(images[0])
+                continue
+            message = {"image": images[0].hex()} if batch_size == 1 else {"images": [image.hex() for image in images]}
+        payloads.append(json.dumps(message).encode('utf-8'))
+    return payloads
+
+def levels(scenario: Dict[str, Any], args) -> List[Tuple[int, int]]:
+    batch_sizes = args.batch_sizes or scenario.get("batch_sizes", [1])
+    if TARGETS[scenario["function"]]["input"] == "raw-image":
+        # the orchestrator takes one image per request
+        batch_sizes = [1]
+    return [(batch_size, concurrency) for batch_size in batch_sizes for concurrency in args.concurrency or scenario.get("concurrency", [1])]
+
+# load generation
+
+def count_faces(response: Dict[str, Any]) -> int:
+    if "results" in response:
+        return sum(count_faces(result) for result in response["results"])
+    return response.get("num_faces_detected", 0)
+
+def run_level(call: Callable[[bytes], Tuple[bool, bytes]], payloads: List[bytes], concurrency: int, warmup: int,
+              usage: Callable[[], Tuple[float, float]]) -> Dict[str, Any]:
+    for payload in payloads[:warmup]:
+        call(payload)
+    payloads = payloads[warmup:]
+    latencies = np.zeros(len(payloads))
+    errors, faces = [0], [0]
+    lock = threading.Lock()
+
+    def worker(index: int):
+        start = time.perf_counter()
+        ok, body = call(payloads[index])
+        latencies[index] = time.perf_counter() - start
+        detected = 0
+        if ok:
+            try:
+                response = json.loads(body)
+                ok = "error" not in response
+                detected = count_faces(response)
+            except ValueError:
+                ok = False
+        with lock:
+            errors[0] += not ok
+            faces[0] += detected
+
+    # a closed loop: each of the concurrency clients sends its next request as soon as the previous one is answered
+    cpu_start, _ = usage()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(len(payloads))))
+    wall = time.perf_counter() - start
+    cpu_end, rss = usage()
+    latencies *= 1000
+    return {
+        "requests": len(payloads), "errors": errors[0], "wall_seconds": wall,
+        "throughput": len(payloads) / wall,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "cpu_percent": (cpu_end - cpu_start) / wall * 100 if cpu_end is not None else None,
+        "rss_mb": rss,
+        "faces_per_request": faces[0] / len(payloads),
+    }
+
+def self_usage(pids: List[int]) -> Tuple[float, float]:
+    # the load generator shares the process, its own share of CPU is small next to model inference;
+    # the functions an orchestrator calls run as servers and are added in
+    times = os.times()
+    cpu, rss = process_usage(pids) if pids else (0.0, 0.0)
+    return times.user + times.system + (cpu or 0.0), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 + (rss or 0.0)
+
+def process_usage(pids: List[int]) -> Tuple[Optional[float], Optional[float]]:
+    # CPU seconds and peak RSS summed over the function servers, read from /proc so only on Linux
+    cpu, rss = 0.0, 0.0
+    try:
+        for pid in pids:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            with open(f"/proc/{pid}/status") as f:
+                rss += next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    except (OSError, StopIteration):
+        return None, None
+    return cpu, rss
+
+def http_call(url: str, content_type: str, query: Dict[str, str]) -> Callable[[bytes], Tuple[bool, bytes]]:
+    target = urlparse(url)
+    path = target.path + (f"?{urlencode(query)}" if query else "")
+    # one keep-alive connection per client thread
+    connections = threading.local()
+
+    def call(payload: bytes) -> Tuple[bool, bytes]:
+        if not hasattr(connections, "conn"):
+            connections.conn = http.client.HTTPConnection(target.hostname, target.port, timeout=REQUEST_TIMEOUT)
+        try:
+            connections.conn.request("POST", path, body=payload, headers={"Content-Type": content_type})
+            response = connections.conn.getresponse()
+            return response.status == 200, response.read()
+        except (OSError, http.client.HTTPException):
+            connections.conn.close()
+            del connections.conn
+            return False, b""
+    return call
+
+# function servers
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def function_env(name: str, extra: Dict[str, str]) -> Dict[str, str]:
+    return {**os.environ, **TARGETS[name].get("env", {}), **extra}
+
+def start_function(name: str, env: Dict[str, str], log_dir: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = {**env, "mode": "http", "upstream_url": f"http://127.0.0.1:{port}", "LOCK_FILE": os.path.join(log_dir, f"{name}.lock")}
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    process = subprocess.Popen([sys.executable, "handler.py"], cwd=os.path.join(ROOT, TARGETS[name]["path"]), env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + READY_TIMEOUT
+    # the servers bind their port only after the models are loaded and warmed up
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with {process.returncode}, see {log.name}")
+        try:
+            urllib.request.urlopen(f"{url}/_/health", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{name} not ready after {READY_TIMEOUT}s, see {log.name}")
+
+class FunctionServers:
+    def __init__(self, env: Dict[str, str], log_dir: str):
+        self.env, self.log_dir = env, log_dir
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.routes: Dict[str, str] = {}
+        self.gateway = start_gateway(self.routes)
+        self.gateway_url = f"http://127.0.0.1:{self.gateway.server_address[1]}"
+
+    def start(self, name: str, env: Dict[str, str]):
+        process, url = start_function(name, {**function_env(name, env), "GATEWAY_URL": self.gateway_url}, self.log_dir)
+        self.processes[name] = process
+        self.routes[name] = url
+
+    def pids(self, names: List[str]) -> List[int]:
+        return [self.processes[name].pid for name in names]
+
+    def stop(self, names: Optional[List[str]] = None):
+        for name in list(names or self.processes):
+            process = self.processes.pop(name)
+            self.routes.pop(name)
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def close(self):
+        self.stop()
+        self.gateway.shutdown()
+        self.gateway.server_close()
+
+# in-process runs, one worker process per scenario so each function imports its own config, utils and models
+
+def in_process_call(handler, query: Dict[str, str]) -> Tuple[Callable[[bytes], Tuple[bool, bytes]], Callable[[], None]]:
+    if not hasattr(handler, "handle_async"):
+        def call(payload: bytes) -> Tuple[bool, bytes]:
+            result = handler.handle(payload)
+            return True, result.encode('utf-8') if isinstance(result, str) else result
+        return call, lambda: None
+
+    # async handlers run on one event loop, like behind the orchestrator's aiohttp server
+    from limits import set_deadline
+    from metrics import finish_trace, start_trace
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def invoke(payload: bytes) -> bytes:
+        trace = start_trace()
+        handler.request_query.set(query)
+        set_deadline()
+        try:
+            return await handler.handle_async(payload)
+        finally:
+            finish_trace(trace)
+
+    def call(payload: bytes) -> Tuple[bool, bytes]:
+        return True, asyncio.run_coroutine_threadsafe(invoke(payload), loop).result()
+
+    def close():
+        asyncio.run_coroutine_threadsafe(handler.close_client_session(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    return call, close
+
+def run_worker(job_path: str, result_path: str):
+    with open(job_path) as f:
+        job = json.load(f)
+    scenario, name = job["scenario"], job["scenario"]["function"]
+    directory = os.path.join(ROOT, TARGETS[name]["path"])
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+    import handler
+    if getattr(handler, "PIPELINE_MODE", None) == "fused":
+        from fused import registry
+        registry.preload(registry.names())
+    if not job["verbose"]:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+
+    call, close = in_process_call(handler, scenario.get("query", {}))
+    face_image = cv2.imread(job["face_image"]) if job["face_image"] else None
+    results = []
+    for batch_size, concurrency in job["levels"]:
+        payloads = make_payloads(scenario, batch_size, concurrency, job["requests"] + job["warmup"], job["seed"], face_image)
+        results.append(run_level(call, payloads, concurrency, job["warmup"], lambda: self_usage(job["pids"])))
+    close()
+    with open(result_path, "w") as f:
+        json.dump(results, f)
+
+def run_in_process(scenario: Dict[str, Any], scenario_levels: List[Tuple[int, int]], args, servers: FunctionServers) -> List[Dict[str, Any]]:
+    depends = TARGETS[scenario["function"]].get("depends", [])
+    for name in depends:
+        servers.start(name, {**args.env, **scenario.get("depends_env", {}).get(name, {})})
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            job_path, result_path = os.path.join(tmp, "job.json"), os.path.join(tmp, "result.json")
+            with open(job_path, "w") as f:
+                json.dump({"scenario": scenario, "levels": scenario_levels, "requests": args.requests or scenario.get("requests", 50),
+                           "warmup": args.warmup, "seed": args.seed, "face_image": args.face_image, "verbose": args.verbose,
+                           "pids": servers.pids(depends)}, f)
+            env = {**function_env(scenario["function"], {**args.env, **scenario.get("env", {})}), "GATEWAY_URL": servers.gateway_url}
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", job_path, result_path], env=env, check=True)
+            with open(result_path) as f:
+                return json.load(f)
+    finally:
+        servers.stop(depends)
+
+def run_http(scenario: Dict[str, Any], scenario_levels: List[Tuple[int, int]], args, servers: Optional[FunctionServers]) -> List[Dict[str, Any]]:
+    name = scenario["function"]
+    started = []
+    if servers:
+        for dependency in TARGETS[name].get("depends", []):
+            servers.start(dependency, {**args.env, **scenario.get("depends_env", {}).get(dependency, {})})
+            started.append(dependency)
+        servers.start(name, {**args.env, **scenario.get("env", {})})
+        started.append(name)
+    gateway_url = servers.gateway_url if servers else args.gateway.rstrip("/")
+    content_type = "application/octet-stream" if TARGETS[name]["input"] == "raw-image" else "application/json"
+    call = http_call(f"{gateway_url}/function/{name}", content_type, scenario.get("query", {}))
+    usage = (lambda: process_usage(servers.pids(started))) if servers else (lambda: (None, None))
+    face_image = cv2.imread(args.face_image) if args.face_image else None
+    try:
+        results = []
+        for batch_size, concurrency in scenario_levels:
+            payloads = make_payloads(scenario, batch_size, concurrency, (args.requests or scenario.get("requests", 50)) + args.warmup, args.seed, face_image)
+            results.append(run_level(call, payloads, concurrency, args.warmup, usage))
+        return results
+    finally:
+        if servers:
+            servers.stop(started)
+
+# reporting
+
+def result_key(mode: str, scenario: str, batch_size: int, concurrency: int) -> str:
+    return f"{mode}/{scenario}/b{batch_size}/c{concurrency}"
+
+def format_optional(value: Optional[float], width: int, precision: int) -> str:
+    return f"{value:>{width}.{precision}f}" if value is not None else f"{'-':>{width}}"
+
+def print_row(key: str, result: Dict[str, Any], batch_size: int, flags: List[str]):
+    print(f"{key:<52} {result['throughput']:>8.2f} {result['throughput'] * batch_size:>9.2f} {result['p50_ms']:>9.2f} "
+          f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {format_optional(result['cpu_percent'], 7, 0)} "
+          f"{format_optional(result['rss_mb'], 8, 1)} {result['faces_per_request']:>6.1f} {result['errors']:>6}"
+          + (f"   REGRESSION: {', '.join(flags)}" if flags else ""))
+
+def regressions(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    flags = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        flags.append(f"throughput {result['throughput']:.2f} < {baseline['throughput']:.2f}")
+    for metric in ("p50_ms", "p95_ms", "p99_ms", "rss_mb"):
+        if result.get(metric) is not None and baseline.get(metric) is not None and result[metric] > baseline[metric] * (1 + tolerance):
+            flags.append(f"{metric} {result[metric]:.1f} > {baseline[metric]:.1f}")
+    if result["errors"] > baseline["errors"]:
+        flags.append(f"errors {result['errors']} > {baseline['errors']}")
+    return flags
+
+def parse_env(values: List[str]) -> Dict[str, str]:
+    return dict(value.split("=", 1) for value in values)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark of the functions, in-process and over HTTP through a local stand-in gateway")
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD, help="JSONL file with one scenario per line")
+    parser.add_argument("--scenarios", nargs="+", help="only run these scenarios")
+    parser.add_argument("--mode", choices=["inprocess", "http", "both"], default="inprocess")
+    parser.add_argument("--gateway", default="", help="benchmark an already running gateway instead of starting the functions locally")
+    parser.add_argument("--requests", type=int, default=0, help="requests per level, overrides the workload")
+    parser.add_argument("--concurrency", type=int, nargs="+", help="overrides the workload")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", help="overrides the workload")
+    parser.add_argument("--warmup", type=int, default=5, help="requests sent before each level is measured")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="environment for every function, can be repeated")
+    parser.add_argument("--face-image", default="", help="face photo pasted into the synthetic images instead of the drawn faces")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="", help="write all results to this JSON file")
+    parser.add_argument("--save-baseline", default="", help="store the results as the baseline")
+    parser.add_argument("--baseline", default="", help="compare against this baseline, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change tolerated before flagging a regression")
+    parser.add_argument("--verbose", action="store_true", help="keep the functions' INFO logging in in-process runs")
+    parser.add_argument("--worker", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(*args.worker)
+        return
+
+    args.env = parse_env(args.env)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    modes = ["inprocess", "http"] if args.mode == "both" else [args.mode]
+    scenarios = load_workload(args.workload, args.scenarios)
+
+    results: Dict[str, Any] = {}
+    regressed = []
+    log_dir = tempfile.mkdtemp(prefix="faas-benchmark-")
+    servers = FunctionServers(args.env, log_dir) if not args.gateway or "inprocess" in modes else None
+    print(f"{'run':<52} {'req/s':>8} {'items/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cpu %':>7} "
+          f"{'rss MB':>8} {'faces':>6} {'errors':>6}")
+    try:
+        for mode in modes:
+            for scenario in scenarios:
+                scenario_levels = levels(scenario, args)
+                if mode == "inprocess":
+                    scenario_results = run_in_process(scenario, scenario_levels, args, servers)
+                else:
+                    scenario_results = run_http(scenario, scenario_levels, args, None if args.gateway else servers)
+                for (batch_size, concurrency), result in zip(scenario_levels, scenario_results):
+                    key = result_key(mode, scenario["name"], batch_size, concurrency)
+                    results[key] = result
+                    flags = regressions(result, baseline[key], args.tolerance) if key in baseline else []
+                    if flags:
+                        regressed.append(key)
+                    print_row(key, result, batch_size, flags)
+    finally:
+        if servers:
+            servers.close()
+    if servers:
+        print(f"\nfunction logs in {log_dir}")
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "cpu_count": os.cpu_count(), "env": args.env, "results": results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if regressed:
+        print(f"{len(regressed)} of {len(results)} runs regressed by more than {args.tolerance:.0%} against {args.baseline}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
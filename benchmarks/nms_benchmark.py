@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions", "face-detection"))
+from utils import compute_iou, nms  # noqa: E402
+
+ANCHOR_COUNTS = [500, 1000, 2000, 4420, 8840, 17640]  # 4420 anchors for RFB-320, 17640 for RFB-640
+
+def legacy_nms(boxes, scores, iou_threshold):
+    # the loop face-detection used before the vectorized rewrite, kept as the baseline
+    sorted_indices = np.argsort(scores)[::-1]
+    keep_boxes = []
+    while sorted_indices.size > 0:
+        box_id = sorted_indices[0]
+        keep_boxes.append(box_id)
+        ious = compute_iou(boxes[box_id, :], boxes[sorted_indices[1:], :])
+        keep_indices = np.where(ious < iou_threshold)[0]
+        sorted_indices = sorted_indices[keep_indices + 1]
+    return keep_boxes
+
+def synthetic_anchors(count, faces, rng):
+    # anchors that survive the probability mask cluster tightly around the faces in the image
+    centers = rng.uniform(0.1, 0.9, (faces, 2))
+    sizes = rng.uniform(0.02, 0.1, (faces, 1))
+    owners = rng.integers(0, faces, count)
+    jittered_centers = centers[owners] + rng.normal(0, 0.01, (count, 2))
+    jittered_sizes = sizes[owners] * rng.uniform(0.8, 1.2, (count, 1))
+    boxes = np.concatenate([jittered_centers - jittered_sizes / 2, jittered_centers + jittered_sizes / 2], axis=1)
+    return boxes.astype(np.float32), rng.uniform(0.5, 1.0, count).astype(np.float32)
+
+def time_ms(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the face-detection NMS variants")
+    parser.add_argument("--faces", type=int, default=50, help="number of face clusters in each synthetic anchor set")
+    parser.add_argument("--iou-threshold", type=float, default=0.3)
+    parser.add_argument("--candidate-size", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    variants = {
+        "legacy": lambda b, s: legacy_nms(b, s, args.iou_threshold),
+        "hard": lambda b, s: nms(b, s, args.iou_threshold),
+        "hard+caps": lambda b, s: nms(b, s, args.iou_threshold, top_k=args.top_k, candidate_size=args.candidate_size),
+    }
+
+    print(f"{'anchors':>8} " + " ".join(f"{name:>12}" for name in variants) + "   (ms, best of %d)" % args.repeat)
+    for count in ANCHOR_COUNTS:
+        boxes, scores = synthetic_anchors(count, args.faces, rng)
+        # the vectorized NMS keeps exactly the boxes of the legacy loop, in the same order
+        assert np.array_equal(legacy_nms(boxes, scores, args.iou_threshold), nms(boxes, scores, args.iou_threshold))
+        timings = [time_ms(lambda: fn(boxes, scores), args.repeat) for fn in variants.values()]
+        print(f"{count:>8} " + " ".join(f"{timing:>12.2f}" for timing in timings))
+
+if __name__ == "__main__":
+    main()
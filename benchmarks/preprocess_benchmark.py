@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions", "face-detection"))
+from utils import input_buffer, preprocess_detector  # noqa: E402
+
+INPUT_SIZE = (320, 240)
+IMAGE_SIZES = [(640, 480), (1280, 720), (1920, 1080)]
+
+def legacy_preprocess(images):
+    # the per-image path face-detection used before, float64 normalization and a temporary per step
+    batch = []
+    for orig_image in images:
+        image = cv2.cvtColor(orig_image, cv2.COLOR_BGR2RGB)
+        image = cv2.resize(image, INPUT_SIZE)
+        image = (image - 127.5) / 128
+        image = np.transpose(image, [2, 0, 1])
+        image = np.expand_dims(image, axis=0)
+        batch.append(image.astype(np.float32))
+    return np.concatenate(batch)
+
+def buffer_preprocess(images):
+    # the batch is read after its buffer went back to the pool, which only holds while a single thread uses it
+    with input_buffer((len(images), 3, INPUT_SIZE[1], INPUT_SIZE[0])) as buffer:
+        return preprocess_detector(images, INPUT_SIZE, "buffer", out=buffer)
+
+def time_ms(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+def peak_kb(fn):
+    # numpy allocations are traced, the ones made inside OpenCV are not
+    fn()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the face-detection preprocessing variants")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--model", default="", help="RFB-320 model, also times detection one image per run against one batched run")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    variants = {
+        "legacy": legacy_preprocess,
+        "buffer": buffer_preprocess,
+        "blob": lambda images: preprocess_detector(images, INPUT_SIZE, "blob"),
+    }
+
+    print(f"{'image':>10} {'batch':>6} " + " ".join(f"{name + ' ms':>10} {name + ' KB':>10}" for name in variants)
+          + "   (best of %d, peak numpy memory)" % args.repeat)
+    for width, height in IMAGE_SIZES:
+        for batch_size in args.batch_sizes:
+            images = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(batch_size)]
+            reference = legacy_preprocess(images)
+            for name, fn in variants.items():
+                assert np.allclose(fn(images), reference, atol=1e-6), f"{name} differs from the legacy preprocessing"
+            timings = [(time_ms(lambda: fn(images), args.repeat), peak_kb(lambda: fn(images))) for fn in variants.values()]
+            print(f"{f'{width}x{height}':>10} {batch_size:>6} " + " ".join(f"{ms:>10.3f} {kb:>10.1f}" for ms, kb in timings))
+
+    if args.model:
+        import onnxruntime as ort
+        session = ort.InferenceSession(args.model, providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        fixed_batch_size = session.get_inputs()[0].shape[0]
+        print(f"\n{'batch':>6} {'per image ms':>14} {'batched ms':>12}")
+        for batch_size in args.batch_sizes:
+            images = [rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(batch_size)]
+            per_image = time_ms(lambda: [session.run(None, {input_name: legacy_preprocess([image])}) for image in images], args.repeat)
+            if isinstance(fixed_batch_size, int) and fixed_batch_size != batch_size:
+                print(f"{batch_size:>6} {per_image:>14.3f} {'static batch':>12}")
+                continue
+            batched = time_ms(lambda: session.run(None, {input_name: preprocess_detector(images, INPUT_SIZE)}), args.repeat)
+            print(f"{batch_size:>6} {per_image:>14.3f} {batched:>12.3f}")
+
+if __name__ == "__main__":
+    main()
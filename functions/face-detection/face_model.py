@@ -0,0 +1,174 @@
+import os
+import time
+import numpy as np
+from typing import Any, Dict, List
+from logger import logger
+from batcher import MicroBatcher
+from metrics import FACES_PER_REQUEST, timed
+from ort_session import BoundSession, create_session
+from registry import ModelRegistry, model_size
+
+BATCHING_ENABLED = os.getenv("BATCHING_ENABLED", "true").lower() == "true"
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 5))
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+def model_setting(name: str, key: str, default: str) -> str:
+    # <KEY>_<NAME> sets one model of a process that hosts several, <KEY> every face model it hosts
+    return os.getenv(f"{key}_{name.upper().replace('-', '_')}", os.getenv(key, default))
+
+class FaceModel:
+    name = ""
+    # the original export and its conversions from scripts/convert_face_models.py (a dynamic-batch copy and an INT8 model), by MODEL_VARIANT
+    model_files: Dict[str, str] = {}
+    default_variant = "fp32"
+    default_batch_max_size = 32
+
+    @classmethod
+    def model_path(cls) -> str:
+        return model_setting(cls.name, "MODEL_PATH", cls.model_files[model_setting(cls.name, "MODEL_VARIANT", cls.default_variant)])
+
+    def __init__(self):
+        start = time.perf_counter()
+        self.path = self.model_path()
+        self.session = self.load()
+        logger.info(f"{self.name} model loaded successfully ({self.path}).")
+        self.fixed_batch_size = getattr(self.session, "fixed_batch_size", None)
+        batch_max_size = int(model_setting(self.name, "BATCH_MAX_SIZE", str(self.default_batch_max_size)))
+        # the batch sizes the warm-up runs, by default a single image and a full micro-batch
+        self.warmup_batch_sizes = [int(b) for b in model_setting(self.name, "WARMUP_BATCH_SIZES", f"1,{batch_max_size}").split(",") if b.strip()]
+        self.batcher = (
+            MicroBatcher(self.run_batch, batch_max_size, BATCH_MAX_WAIT_MS, item_size=len, name=self.name)
+            if BATCHING_ENABLED and self.batching_supported() else None
+        )
+        self.load_seconds = time.perf_counter() - start
+        self.warmup_seconds = 0.0
+        if WARMUP_ENABLED:
+            self.warm_up()
+
+    def load(self):
+        return BoundSession(create_session(self.path))
+
+    def input_shape(self) -> List[int]:
+        return list(self.session.input.shape[1:])
+
+    def run(self, batch: np.ndarray) -> List[np.ndarray]:
+        fixed_batch_size = self.fixed_batch_size
+        if fixed_batch_size and fixed_batch_size != len(batch):
+            # the model was exported with a static batch dimension, so feed it in slices of that size
+            outputs = [self.session.run(batch[i:i + fixed_batch_size]) for i in range(0, len(batch), fixed_batch_size)]
+            return [np.concatenate(output) for output in zip(*outputs)]
+        return self.session.run(batch)
+
+    def run_batch(self, inputs: List[np.ndarray]) -> List[List[np.ndarray]]:
+        outputs = self.run(np.concatenate(inputs))
+        splits = np.cumsum([len(x) for x in inputs])[:-1]
+        return [list(item_outputs) for item_outputs in zip(*(np.split(output, splits) for output in outputs))]
+
+    def run_inference(self, batch: np.ndarray) -> List[np.ndarray]:
+        return self.batcher.run(batch) if self.batcher is not None else self.run(batch)
+
+    def batching_supported(self) -> bool:
+        if self.fixed_batch_size:
+            # a batch would be split back into runs of the fixed size, so waiting for one only adds latency
+            logger.warning(f"{self.path} has a static batch size of {self.fixed_batch_size}, micro-batching is disabled; "
+                           "scripts/convert_face_models.py writes a dynamic-batch copy, served as MODEL_VARIANT=fp32-dynamic")
+            return False
+        return True
+
+    def warm_up(self):
+        # one run per expected batch size, so the first requests after a load skip kernel initialization and first-call allocations
+        start = time.perf_counter()
+        # a static-batch model only ever runs at its fixed batch size
+        batch_sizes = [self.fixed_batch_size] if self.fixed_batch_size else self.warmup_batch_sizes
+        for batch_size in batch_sizes:
+            self.run(np.zeros((batch_size, *self.input_shape()), dtype=np.float32))
+        self.warmup_seconds = time.perf_counter() - start
+        logger.info(f"Warmed up {self.name} for batch sizes {batch_sizes} in {self.warmup_seconds:.2f}s")
+
+    def infer(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def close(self):
+        # an evicted model drains its queued requests before the session is dropped
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model_path": self.path,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "batcher": self.batcher.stats() if self.batcher is not None else {}
+        }
+
+class FaceClassifier(FaceModel):
+    # "gender" answers {"num_faces_processed", "gender_results": [{"face_id", "gender_result", ...}]}
+    result_name = ""
+
+    def decode_face(self, image_data: bytes) -> np.ndarray:
+        raise NotImplementedError
+
+    def preprocess_batch(self, faces: List[np.ndarray]) -> np.ndarray:
+        raise NotImplementedError
+
+    def format_output(self, output: np.ndarray) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def infer(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        if "faces" not in input_data or not input_data["faces"]:
+            return {"error": "No faces provided in the input"}
+        return self.process_faces(input_data["faces"])
+
+    def process_faces(self, faces: list) -> Dict[str, Any]:
+        decoded_faces, valid_faces = [], []
+        with timed("decode"):
+            for face in faces:
+                try:
+                    face_id = face["face_id"]
+                    face_image = face["face_image"]
+
+                    if not face_image:
+                        logger.warning(f"No image data for face_id: {face_id}")
+                        continue
+
+                    face_image_bytes = face_image if isinstance(face_image, bytes) else bytes.fromhex(face_image)
+                    decoded_faces.append(self.decode_face(face_image_bytes))
+                    valid_faces.append(face)
+                except Exception as e:
+                    logger.error(f"Error processing face {face.get('face_id')}: {str(e)}")
+
+        outputs = None
+        if valid_faces:
+            try:
+                # all crops of the request form one batch, a single forward pass on a dynamic-batch model
+                with timed("preprocess"):
+                    batch = self.preprocess_batch(decoded_faces)
+                with timed("inference"):
+                    outputs = self.run_inference(batch)[0]
+            except Exception as e:
+                logger.error(f"Batched {self.result_name} inference failed, retrying faces one by one: {str(e)}")
+
+        results = []
+        with timed("postprocess"):
+            for i, face in enumerate(valid_faces):
+                try:
+                    output = outputs[i] if outputs is not None else self.run_inference(self.preprocess_batch(decoded_faces[i:i + 1]))[0][0]
+
+                    results.append({
+                        "face_id": face["face_id"],
+                        f"{self.result_name}_result": self.format_output(output),
+                        "face_detection_confidence": face["confidence"]
+                    })
+                except Exception as e:
+                    logger.error(f"Error processing face {face['face_id']}: {str(e)}")
+        FACES_PER_REQUEST.observe(len(results))
+
+        return {
+            "num_faces_processed": len(results),
+            f"{self.result_name}_results": results
+        }
+
+def register_face_models(registry: ModelRegistry, models: List[type]):
+    # a model is loaded, and warmed up, on its first request unless it is preloaded
+    for model in models:
+        registry.register(model.name, model, model_size(model.model_path()))
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import ContextVar
+from queue import Empty, Queue
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# monotonic deadline of the request being handled, set by the server from the caller's X-Request-Timeout
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    pass
+
+class MicroBatcher:
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float,
+                 item_size: Callable[[Any], int] = lambda item: 1, name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.item_size = item_size
+        self.name = name
+        self._queue: "Queue[Tuple[Any, Future, Optional[float]]]" = Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._max_queue_depth = 0
+        self._expired = 0
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        future: Future = Future()
+        entry = (item, future, request_deadline.get())
+        with self._submit_lock:
+            if not self._closed:
+                self._queue.put(entry)
+                return future
+        # a closed batcher (e.g. its model was evicted) still answers stragglers, one item at a time
+        self._process([entry], self.item_size(item))
+        return future
+
+    def close(self):
+        # the worker finishes everything queued before the stop marker and then exits
+        with self._submit_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put((_STOP, None, None))
+
+    def run(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "max_batch_size": self._largest_batch,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "expired": self._expired,
+            }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0][0] is _STOP:
+                return
+            size = self.item_size(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if entry[0] is _STOP:
+                    self._process(batch, size)
+                    return
+                batch.append(entry)
+                size += self.item_size(entry[0])
+            self._process(batch, size)
+
+    def _process(self, batch: List[Tuple[Any, Future, Optional[float]]], size: int):
+        # items whose caller has already given up are answered without running them
+        now = time.monotonic()
+        expired = [entry for entry in batch if entry[2] is not None and entry[2] <= now]
+        if expired:
+            batch = [entry for entry in batch if entry[2] is None or entry[2] > now]
+            size = sum(self.item_size(item) for item, _, _ in batch)
+            with self._lock:
+                self._expired += len(expired)
+            logger.warning(f"{self.name}: dropping {len(expired)} requests past their deadline")
+            for _, future, _ in expired:
+                future.set_exception(DeadlineExceeded("Request deadline exceeded"))
+            if not batch:
+                return
+        queue_depth = self._queue.qsize()
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            self._largest_batch = max(self._largest_batch, size)
+            self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+        BATCH_SIZE.labels(self.name).observe(size)
+        logger.debug(f"{self.name}: running batch of {size} items ({len(batch)} requests), queue depth {queue_depth}")
+
+        try:
+            results = self.process_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
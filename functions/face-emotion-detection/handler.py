@@ -1,7 +1,20 @@
 import json
+import os
 import sys
+import wire
 from logger import logger
-from emotion_detection import process_faces
+from metrics import timed
+from registry import ModelRegistry
+from server import SERVER_MODE, serve
+from face_model import register_face_models
+from emotion_detection import EmotionClassifier
+
+# models not listed here are loaded on their first request
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", EmotionClassifier.name).split(",") if name.strip() == EmotionClassifier.name]
+
+registry = ModelRegistry()
+register_face_models(registry, [EmotionClassifier])
+registry.preload(PRELOAD_MODELS)
 
 def handle(req: bytes) -> bytes:
     try:
@@ -10,14 +23,14 @@ def handle(req: bytes) -> bytes:
         if not req:
             return json.dumps({"error": "Empty request"}).encode('utf-8')
         
-        input_data = json.loads(req.decode('utf-8'))
-        
-        if "faces" not in input_data or not input_data["faces"]:
-            return json.dumps({"error": "No faces provided in the input"}).encode('utf-8')
+        binary = wire.is_frame(req)
+        with timed("deserialize"):
+            input_data = wire.decode(req) if binary else json.loads(req.decode('utf-8'))
         
-        result = process_faces(input_data["faces"])
+        result = registry.get(EmotionClassifier.name).infer(input_data)
         
-        return json.dumps(result).encode('utf-8')
+        with timed("serialize"):
+            return wire.encode(result) if binary else wire.to_json(result)
     
     except json.JSONDecodeError:
         logger.error("Invalid JSON input")
@@ -27,13 +40,17 @@ def handle(req: bytes) -> bytes:
         return json.dumps({"error": f"An unexpected error occurred: {str(e)}"}).encode('utf-8')
 
 if __name__ == "__main__":
-    try:
-        input_data = sys.stdin.buffer.read()
-        ret = handle(input_data)
-        sys.stdout.buffer.write(ret)
-        sys.stdout.buffer.flush()
-    except Exception as e:
-        logger.error(f"Error in main execution: {str(e)}", exc_info=True)
-        error_response = json.dumps({"error": f"Main execution failed: {str(e)}"}).encode('utf-8')
-        sys.stdout.buffer.write(error_response)
-        sys.stdout.buffer.flush()
\ No newline at end of file
+    if SERVER_MODE == "http":
+        serve(handle, response_type=wire.content_type,
+              stats=lambda: {"registry": registry.stats(), "models": {name: model.stats() for name, model in registry.loaded().items()}})
+    else:
+        try:
+            input_data = sys.stdin.buffer.read()
+            ret = handle(input_data)
+            sys.stdout.buffer.write(ret)
+            sys.stdout.buffer.flush()
+        except Exception as e:
+            logger.error(f"Error in main execution: {str(e)}", exc_info=True)
+            error_response = json.dumps({"error": f"Main execution failed: {str(e)}"}).encode('utf-8')
+            sys.stdout.buffer.write(error_response)
+            sys.stdout.buffer.flush()
\ No newline at end of file
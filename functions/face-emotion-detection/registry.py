@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# approximate budget for loaded models, measured by model file size; 0 keeps every model loaded
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))
+
+def model_size(path: str) -> int:
+    # the model file size stands in for the memory a loaded model takes
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+class ModelRegistry:
+    def __init__(self, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._loads = 0
+        self._evictions = 0
+        self._load_seconds: Dict[str, float] = {}
+
+    def register(self, name: str, loader: Callable[[], Any], size_bytes: int = 0):
+        self._loaders[name] = loader
+        self._sizes[name] = size_bytes
+        self._load_locks[name] = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._loaders
+
+    def names(self) -> List[str]:
+        return list(self._loaders)
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                return model
+
+        # loads of different models may overlap, concurrent first requests for the same model wait for one load
+        with self._load_locks[name]:
+            with self._lock:
+                model = self._models.get(name)
+                if model is not None:
+                    self._models.move_to_end(name)
+                    return model
+            start = time.perf_counter()
+            model = self._loaders[name]()
+            self._load_seconds[name] = time.perf_counter() - start
+            logger.info(f"Loaded model {name} in {self._load_seconds[name]:.2f}s")
+            with self._lock:
+                self._models[name] = model
+                self._loads += 1
+                evicted = self._evict(keep=name)
+        for evicted_name, evicted_model in evicted:
+            logger.info(f"Evicted model {evicted_name} to stay within the model memory budget")
+            if hasattr(evicted_model, "close"):
+                evicted_model.close()
+        return model
+
+    def preload(self, names: List[str]):
+        for name in names:
+            self.get(name)
+
+    def loaded_bytes(self) -> int:
+        return sum(self._sizes[name] for name in self._models)
+
+    def _evict(self, keep: str) -> List[Any]:
+        evicted = []
+        if self.memory_budget <= 0:
+            return evicted
+        while self.loaded_bytes() > self.memory_budget and len(self._models) > 1:
+            name = next(name for name in self._models if name != keep)
+            evicted.append((name, self._models.pop(name)))
+            self._evictions += 1
+        return evicted
+
+    def loaded(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._models)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "registered": list(self._loaders),
+                "loaded": list(self._models),
+                "loaded_bytes": self.loaded_bytes(),
+                "memory_budget_bytes": self.memory_budget,
+                "loads": self._loads,
+                "evictions": self._evictions,
+                "load_seconds": dict(self._load_seconds),
+            }
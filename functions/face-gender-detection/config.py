@@ -1,6 +0,0 @@
-import os
-
-MODEL_PATH = os.getenv("MODEL_PATH", "gender_googlenet.caffemodel")
-CONFIG_PATH = os.getenv("CONFIG_PATH", "gender_googlenet.prototxt")
-
-GENDER_LABELS = ['Male', 'Female']
\ No newline at end of file
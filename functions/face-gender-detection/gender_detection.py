@@ -1,41 +1,50 @@
-from typing import Dict, Any
-from config import GENDER_LABELS
-from model_loader import gender_model
-from image_processing import preprocess_image
-from logger import logger
-
-def predict_gender(image_data: bytes) -> Dict[str, Any]:
-    blob = preprocess_image(image_data)
-    gender_model.setInput(blob)
-    output = gender_model.forward()
-    gender_index = output[0].argmax()
-    gender = GENDER_LABELS[gender_index]
-    confidence = float(output[0][gender_index])
-    return {"predicted_gender": gender, "gender_confidence": confidence}
-
-def process_faces(faces: list) -> Dict[str, Any]:
-    results = []
-    for face in faces:
-        try:
-            face_id = face["face_id"]
-            face_image = face["face_image"]
-            
-            if not face_image:
-                logger.warning(f"No image data for face_id: {face_id}")
-                continue
-            
-            face_image_bytes = bytes.fromhex(face_image)
-            gender_result = predict_gender(face_image_bytes)
-            
-            results.append({
-                "face_id": face_id,
-                "gender_result": gender_result,
-                "face_detection_confidence": face["confidence"]
-            })
-        except Exception as e:
-            logger.error(f"Error processing face {face_id}: {str(e)}")
-    
-    return {
-        "num_faces_processed": len(results),
-        "gender_results": results
-    }
\ No newline at end of file
+import cv2
+import threading
+import numpy as np
+from typing import Dict, Any, List
+from face_model import FaceClassifier, model_setting
+from ort_session import BoundSession
+
+GENDER_LABELS = ['Male', 'Female']
+
+class GenderClassifier(FaceClassifier):
+    name = "face-gender-detection"
+    # caffe runs the original model through cv2.dnn, fp32 and int8 run its ONNX conversions
+    model_files = {"caffe": "gender_googlenet.caffemodel", "fp32": "gender_googlenet.onnx", "fp32-dynamic": "gender_googlenet-dynamic.onnx",
+                   "int8": "gender_googlenet-int8.onnx"}
+    default_variant = "caffe"
+    result_name = "gender"
+
+    def load(self):
+        # cv2.dnn.Net keeps its input as state, so concurrent requests must not interleave setInput/forward
+        self.model_lock = threading.Lock()
+        # the ONNX conversions run on onnxruntime like the other face models, the Caffe original on cv2.dnn
+        if self.path.endswith(".onnx"):
+            return super().load()
+        return cv2.dnn.readNet(self.path, model_setting(self.name, "CONFIG_PATH", "gender_googlenet.prototxt"))
+
+    def input_shape(self) -> List[int]:
+        return [3, 224, 224]
+
+    def run(self, blob: np.ndarray) -> List[np.ndarray]:
+        if isinstance(self.session, BoundSession):
+            return super().run(blob)
+        with self.model_lock:
+            self.session.setInput(blob)
+            return [self.session.forward()]
+
+    def decode_face(self, image_data: bytes) -> np.ndarray:
+        nparr = np.frombuffer(image_data, np.uint8)
+        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Failed to decode face image")
+        return image
+
+    def preprocess_batch(self, faces: List[np.ndarray]) -> np.ndarray:
+        return cv2.dnn.blobFromImages(faces, 1.0, (224, 224), (104, 117, 123), swapRB=False)
+
+    def format_output(self, output: np.ndarray) -> Dict[str, Any]:
+        gender_index = output.argmax()
+        gender = GENDER_LABELS[gender_index]
+        confidence = float(output[gender_index])
+        return {"predicted_gender": gender, "gender_confidence": confidence}
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+from typing import Dict, Any, List
+from face_model import FaceClassifier
+
+EMOTION_TABLE = {
+    0: 'neutral', 1: 'happiness', 2: 'surprise', 3: 'sadness',
+    4: 'anger', 5: 'disgust', 6: 'fear', 7: 'contempt'
+}
+
+def softmax(scores):
+    exp = np.exp(scores - np.max(scores))
+    return exp / exp.sum()
+
+class EmotionClassifier(FaceClassifier):
+    name = "face-emotion-detection"
+    model_files = {"fp32": "emotion-ferplus-8.onnx", "fp32-dynamic": "emotion-ferplus-8-dynamic.onnx", "int8": "emotion-ferplus-8-int8.onnx"}
+    result_name = "emotion"
+
+    def decode_face(self, image_data: bytes) -> np.ndarray:
+        nparr = np.frombuffer(image_data, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("Failed to decode face image")
+        return cv2.resize(img, (64, 64))
+
+    def preprocess_batch(self, faces: List[np.ndarray]) -> np.ndarray:
+        return np.stack(faces)[:, np.newaxis].astype(np.float32)
+
+    def format_output(self, output: np.ndarray) -> Dict[str, Any]:
+        probabilities = softmax(output)
+
+        emotion_index = np.argmax(probabilities)
+        emotion = EMOTION_TABLE[emotion_index]
+        confidence = float(probabilities[emotion_index])
+
+        return {
+            "predicted_emotion": emotion,
+            "emotion_confidence": confidence,
+            "emotion_probabilities": {EMOTION_TABLE[i]: float(prob) for i, prob in enumerate(probabilities)}
+        }
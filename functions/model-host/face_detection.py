@@ -0,0 +1,189 @@
+import os
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Tuple
+from logger import logger
+from face_model import FaceModel
+from metrics import FACES_PER_REQUEST, timed
+from utils import clip_box, detection_windows, detector_input_size, input_buffer, merge_window_detections, nms, preprocess_detector
+
+DETECTION_THRESHOLD = float(os.getenv("DETECTION_THRESHOLD", 0.8))
+# "buffer" writes float32 straight into a reused NCHW buffer, "blob" uses cv2.dnn.blobFromImages
+PREPROCESS_METHOD = os.getenv("PREPROCESS_METHOD", "buffer")
+# "single" resizes the whole image to the model input, "tiled" runs overlapping tiles, "multiscale" runs the whole
+# image and the tiles, "adaptive" picks single or ADAPTIVE_LARGE_MODE from the image size
+DETECTION_MODE = os.getenv("DETECTION_MODE", "single")
+# a tile covers TILE_SCALE times the model input in image pixels
+TILE_SCALE = float(os.getenv("TILE_SCALE", 2))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", 0.25))
+MAX_TILES = int(os.getenv("MAX_TILES", 16))
+# adaptive mode tiles images that would be shrunk by more than this factor to fit the model input
+ADAPTIVE_SCALE_THRESHOLD = float(os.getenv("ADAPTIVE_SCALE_THRESHOLD", 3))
+ADAPTIVE_LARGE_MODE = os.getenv("ADAPTIVE_LARGE_MODE", "multiscale")
+
+NMS_IOU_THRESHOLD = float(os.getenv("NMS_IOU_THRESHOLD", 0.3))
+NMS_CANDIDATE_SIZE = int(os.getenv("NMS_CANDIDATE_SIZE", 1000))
+MAX_DETECTIONS = int(os.getenv("MAX_DETECTIONS", 200))
+
+def predict(width, height, confidences, boxes, prob_threshold, iou_threshold=NMS_IOU_THRESHOLD, top_k=MAX_DETECTIONS):
+    boxes, confidences = boxes[0], confidences[0]
+    picked_box_probs = []
+    picked_labels = []
+    for class_index in range(1, confidences.shape[1]):
+        probs = confidences[:, class_index]
+        mask = probs > prob_threshold
+        probs = probs[mask]
+        if probs.shape[0] == 0:
+            continue
+        subset_boxes = boxes[mask, :]
+        box_probs = np.concatenate([subset_boxes, probs.reshape(-1, 1)], axis=1)
+        keep = nms(box_probs[:, :4], box_probs[:, 4], iou_threshold, top_k=top_k, candidate_size=NMS_CANDIDATE_SIZE)
+        box_probs = box_probs[keep]
+        picked_box_probs.append(box_probs)
+        picked_labels.extend([class_index] * box_probs.shape[0])
+    if not picked_box_probs:
+        return np.array([]), np.array([]), np.array([])
+    picked_box_probs = np.concatenate(picked_box_probs)
+    picked_labels = np.array(picked_labels)
+    if top_k > 0 and picked_box_probs.shape[0] > top_k:
+        top_indices = np.argsort(picked_box_probs[:, 4])[::-1][:top_k]
+        picked_box_probs, picked_labels = picked_box_probs[top_indices], picked_labels[top_indices]
+    picked_box_probs[:, :4] *= np.array([width, height, width, height])
+    return picked_box_probs[:, :4].astype(np.int32), picked_labels, picked_box_probs[:, 4]
+
+def extract_faces(orig_image: np.ndarray, boxes, probs) -> Dict[str, Any]:
+    FACES_PER_REQUEST.observe(len(boxes))
+    height, width = orig_image.shape[:2]
+    results = []
+    for i, box in enumerate(boxes):
+        try:
+            x1, y1, x2, y2 = clip_box(box, width, height)
+            face = orig_image[y1:y2, x1:x2]
+            if face.size == 0:
+                logger.error(f"Error processing face {i+1}: empty crop for bounding box {box.tolist()}")
+                continue
+            _, face_bytes = cv2.imencode('.jpg', face)
+
+            results.append({
+                "face_id": len(results) + 1,
+                "confidence": float(probs[i]),  # No rounding
+                "bounding_box": [x1, y1, x2, y2],
+                "face_image": face_bytes.tobytes()
+            })
+        except Exception as e:
+            logger.error(f"Error processing face {i+1}: {str(e)}")
+
+    # only faces that made it into the response are counted, as in the orchestrator's fused pipeline
+    return {
+        "num_faces_detected": len(results),
+        "faces": results
+    }
+
+def decode_image(image) -> np.ndarray:
+    with timed("decode"):
+        image_bytes = image if isinstance(image, bytes) else bytes.fromhex(image)
+        return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+class FaceDetector(FaceModel):
+    name = "face-detection"
+    # rfb640 is the 640x480 RFB model
+    model_files = {"fp32": "version-RFB-320.onnx", "fp32-dynamic": "version-RFB-320-dynamic.onnx", "int8": "version-RFB-320-int8.onnx",
+                   "rfb640": "version-RFB-640.onnx", "rfb640-dynamic": "version-RFB-640-dynamic.onnx", "rfb640-int8": "version-RFB-640-int8.onnx"}
+    default_batch_max_size = 8
+
+    def input_shape(self) -> List[int]:
+        width, height = detector_input_size(self.session.input.shape)
+        return [3, height, width]
+
+    def detect_batch(self, images: List[np.ndarray], threshold=DETECTION_THRESHOLD) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        # all images, and all tiles of each image, form one batch, a single run on a dynamic-batch model; results come back in image order
+        if not images:
+            return []
+
+        try:
+            _, input_height, input_width = self.input_shape()
+            windows = [detection_windows(image.shape[1], image.shape[0], (input_width, input_height), DETECTION_MODE, TILE_SCALE, TILE_OVERLAP,
+                                         MAX_TILES, ADAPTIVE_SCALE_THRESHOLD, ADAPTIVE_LARGE_MODE) for image in images]
+            crops = [image[y1:y2, x1:x2] for image, image_windows in zip(images, windows) for x1, y1, x2, y2 in image_windows]
+            # the pooled input buffer is held until the detector, or the micro-batch that copies it, has run
+            with input_buffer((len(crops), 3, input_height, input_width)) as buffer:
+                with timed("preprocess"):
+                    batch = preprocess_detector(crops, (input_width, input_height), PREPROCESS_METHOD, out=buffer)
+                # includes the wait for the micro-batch, which is what the request experiences
+                with timed("inference"):
+                    confidences, boxes = self.run_inference(batch)
+
+            results, offset = [], 0
+            with timed("postprocess"):
+                for image, image_windows in zip(images, windows):
+                    count = len(image_windows)
+                    if count == 1:
+                        results.append(predict(image.shape[1], image.shape[0], confidences[offset:offset + 1], boxes[offset:offset + 1], threshold))
+                    else:
+                        merged_boxes, probs = merge_window_detections(
+                            confidences[offset:offset + count], boxes[offset:offset + count], image_windows, threshold,
+                            NMS_IOU_THRESHOLD, top_k=MAX_DETECTIONS, candidate_size=NMS_CANDIDATE_SIZE)
+                        results.append((merged_boxes, np.ones(len(merged_boxes), dtype=np.int64), probs))
+                    offset += count
+            return results
+        except cv2.error as e:
+            logger.error(f"Error during preprocessing: {str(e)}")
+            return [([], [], [])] * len(images)
+        except Exception as e:
+            logger.error(f"Error during face detection: {str(e)}")
+            return [([], [], [])] * len(images)
+
+    def detect(self, orig_image, threshold=DETECTION_THRESHOLD):
+        logger.info(f"detect input image shape: {orig_image.shape if orig_image is not None else 'None'}")
+        if orig_image is None or orig_image.size == 0:
+            logger.error("Input image is None or empty")
+            return [], [], []
+
+        return self.detect_batch([orig_image], threshold)[0]
+
+    def process_images(self, images: List[Any]) -> Dict[str, Any]:
+        # {"images": [...]} sends several images through the detector as one batch, results keep their order
+        logger.info(f"process_images received {len(images)} images")
+        try:
+            decoded = [decode_image(image) for image in images]
+            valid = [image for image in decoded if image is not None and image.size > 0]
+            detections = iter(self.detect_batch(valid))
+            results = []
+            for i, orig_image in enumerate(decoded):
+                if orig_image is None or orig_image.size == 0:
+                    logger.error(f"Failed to decode image {i} with OpenCV")
+                    results.append({"error": "Failed to decode image"})
+                    continue
+                boxes, _, probs = next(detections)
+                with timed("crop_encode"):
+                    results.append(extract_faces(orig_image, boxes, probs))
+            return {"results": results}
+        except Exception as e:
+            logger.error(f"Error in process_images: {str(e)}")
+            return {"error": f"Image processing failed: {str(e)}"}
+
+    def infer(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        if input_data and isinstance(input_data.get("images"), list):
+            return self.process_images(input_data["images"])
+
+        if not input_data or "image" not in input_data:
+            logger.error("Received empty or invalid image data")
+            return {"error": "Empty or invalid image data"}
+
+        image = input_data["image"]
+        logger.info(f"process_image input data length: {len(image)}")
+
+        try:
+            orig_image = decode_image(image)
+            if orig_image is None:
+                logger.error("Failed to decode image with OpenCV")
+                return {"error": "Failed to decode image"}
+
+            logger.info(f"Decoded image shape: {orig_image.shape}")
+
+            boxes, _, probs = self.detect(orig_image)
+            with timed("crop_encode"):
+                return extract_faces(orig_image, boxes, probs)
+        except Exception as e:
+            logger.error(f"Error in process_image: {str(e)}")
+            return {"error": f"Image processing failed: {str(e)}"}
@@ -0,0 +1,50 @@
+import cv2
+import threading
+import numpy as np
+from typing import Dict, Any, List
+from face_model import FaceClassifier, model_setting
+from ort_session import BoundSession
+
+GENDER_LABELS = ['Male', 'Female']
+
+class GenderClassifier(FaceClassifier):
+    name = "face-gender-detection"
+    # caffe runs the original model through cv2.dnn, fp32 and int8 run its ONNX conversions
+    model_files = {"caffe": "gender_googlenet.caffemodel", "fp32": "gender_googlenet.onnx", "fp32-dynamic": "gender_googlenet-dynamic.onnx",
+                   "int8": "gender_googlenet-int8.onnx"}
+    default_variant = "caffe"
+    result_name = "gender"
+
+    def load(self):
+        # cv2.dnn.Net keeps its input as state, so concurrent requests must not interleave setInput/forward
+        self.model_lock = threading.Lock()
+        # the ONNX conversions run on onnxruntime like the other face models, the Caffe original on cv2.dnn
+        if self.path.endswith(".onnx"):
+            return super().load()
+        return cv2.dnn.readNet(self.path, model_setting(self.name, "CONFIG_PATH", "gender_googlenet.prototxt"))
+
+    def input_shape(self) -> List[int]:
+        return [3, 224, 224]
+
+    def run(self, blob: np.ndarray) -> List[np.ndarray]:
+        if isinstance(self.session, BoundSession):
+            return super().run(blob)
+        with self.model_lock:
+            self.session.setInput(blob)
+            return [self.session.forward()]
+
+    def decode_face(self, image_data: bytes) -> np.ndarray:
+        nparr = np.frombuffer(image_data, np.uint8)
+        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Failed to decode face image")
+        return image
+
+    def preprocess_batch(self, faces: List[np.ndarray]) -> np.ndarray:
+        return cv2.dnn.blobFromImages(faces, 1.0, (224, 224), (104, 117, 123), swapRB=False)
+
+    def format_output(self, output: np.ndarray) -> Dict[str, Any]:
+        gender_index = output.argmax()
+        gender = GENDER_LABELS[gender_index]
+        confidence = float(output[gender_index])
+        return {"predicted_gender": gender, "gender_confidence": confidence}
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+import wire
+from logger import logger
+from metrics import timed
+from registry import ModelRegistry
+from server import SERVER_MODE, request_path, serve
+from engine import register_engines
+from model_specs import MODEL_SPECS
+from face_model import register_face_models
+from face_detection import FaceDetector
+from gender_detection import GenderClassifier
+from emotion_detection import EmotionClassifier
+
+FACE_MODELS = {model.name: model for model in [FaceDetector, GenderClassifier, EmotionClassifier]}
+# any subset of the six models, comma-separated; they share one registry, memory budget and set of ONNX Runtime thread pools
+HOSTED_MODELS = [name.strip() for name in os.getenv("HOSTED_MODELS", ",".join([*MODEL_SPECS, *FACE_MODELS])).split(",") if name.strip()]
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", HOSTED_MODELS[0] if HOSTED_MODELS else "")
+# models not listed here are loaded on their first request
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip() in HOSTED_MODELS]
+
+unknown = [name for name in HOSTED_MODELS if name not in MODEL_SPECS and name not in FACE_MODELS]
+if unknown:
+    raise ValueError(f"Unknown models: {', '.join(unknown)}")
+
+registry = ModelRegistry()
+register_engines(registry, MODEL_SPECS, [name for name in HOSTED_MODELS if name in MODEL_SPECS])
+register_face_models(registry, [FACE_MODELS[name] for name in HOSTED_MODELS if name in FACE_MODELS])
+registry.preload(PRELOAD_MODELS)
+
+def requested_model(input_data) -> str:
+    # /function/model-host/<name> picks a model for callers that send another function's payload unchanged, like the orchestrator
+    path = request_path.get() if SERVER_MODE == "http" else os.getenv("Http_Path", "")
+    return path.strip("/") or input_data.get("model", DEFAULT_MODEL)
+
+def handle(req: bytes) -> bytes:
+    try:
+        if not req:
+            return json.dumps({"error": "Empty request"}).encode('utf-8')
+
+        binary = wire.is_frame(req)
+        with timed("deserialize"):
+            input_data = wire.decode(req) if binary else json.loads(req.decode('utf-8'))
+
+        model = requested_model(input_data)
+        if model not in registry:
+            return json.dumps({"error": f"Unknown model: {model}, this function serves {', '.join(registry.names())}"}).encode('utf-8')
+
+        result = registry.get(model).infer(input_data)
+
+        with timed("serialize"):
+            return wire.encode(result) if binary else wire.to_json(result)
+
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON input")
+        return json.dumps({"error": "Invalid JSON input"}).encode('utf-8')
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return json.dumps({"error": f"An unexpected error occurred: {str(e)}"}).encode('utf-8')
+
+if __name__ == "__main__":
+    if SERVER_MODE == "http":
+        serve(handle, response_type=wire.content_type,
+              stats=lambda: {"registry": registry.stats(), "models": {name: model.stats() for name, model in registry.loaded().items()}})
+    else:
+        try:
+            input_data = sys.stdin.buffer.read()
+            ret = handle(input_data)
+            sys.stdout.buffer.write(ret)
+            sys.stdout.buffer.flush()
+        except Exception as e:
+            logger.error(f"Error in main execution: {str(e)}", exc_info=True)
+            error_response = json.dumps({"error": f"Main execution failed: {str(e)}"}).encode('utf-8')
+            sys.stdout.buffer.write(error_response)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,159 @@
+import logging
+import math
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+def cpu_limit() -> int:
+    # onnxruntime sizes its pools from the host core count, the pod's CPU limit is in its cgroup
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                return max(1, math.ceil(quota / period))
+        except (OSError, ValueError):
+            pass
+    return os.cpu_count() or 1
+
+# all sessions of the process share one intra-op and one inter-op pool instead of each spinning up its own
+ORT_SHARED_THREAD_POOL = os.getenv("ORT_SHARED_THREAD_POOL", "true").lower() == "true"
+# 0 sizes the intra-op pool from the container CPU limit
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", 0)) or cpu_limit()
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", 1))
+ORT_EXECUTION_MODE = os.getenv("ORT_EXECUTION_MODE", "sequential")
+ORT_GRAPH_OPTIMIZATION_LEVEL = os.getenv("ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+ORT_ENABLE_CPU_MEM_ARENA = os.getenv("ORT_ENABLE_CPU_MEM_ARENA", "true").lower() == "true"
+ORT_ENABLE_MEM_PATTERN = os.getenv("ORT_ENABLE_MEM_PATTERN", "true").lower() == "true"
+# optimized graphs are saved here and loaded instead of the original on the next start; empty disables it
+ORT_OPTIMIZED_MODEL_DIR = os.getenv("ORT_OPTIMIZED_MODEL_DIR", "")
+ORT_IO_BINDING = os.getenv("ORT_IO_BINDING", "true").lower() == "true"
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+_thread_pool_lock = threading.Lock()
+_shared_thread_pool = None
+
+def use_shared_thread_pool() -> bool:
+    # the global pools have to be sized before the first session is created, so this runs once
+    global _shared_thread_pool
+    with _thread_pool_lock:
+        if _shared_thread_pool is None:
+            _shared_thread_pool = False
+            if ORT_SHARED_THREAD_POOL:
+                try:
+                    from onnxruntime.capi._pybind_state import set_global_thread_pool_sizes
+                    set_global_thread_pool_sizes(ORT_INTRA_OP_THREADS, ORT_INTER_OP_THREADS)
+                    _shared_thread_pool = True
+                except Exception as e:
+                    # pools created earlier in the process are shared as they are, they cannot be resized
+                    _shared_thread_pool = "already been created" in str(e)
+                    if not _shared_thread_pool:
+                        logger.warning(f"Shared onnxruntime thread pool unavailable, using per-session threads: {str(e)}")
+        return _shared_thread_pool
+
+def session_options() -> ort.SessionOptions:
+    options = ort.SessionOptions()
+    if use_shared_thread_pool():
+        options.use_per_session_threads = False
+    else:
+        options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+        options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.execution_mode = EXECUTION_MODES[ORT_EXECUTION_MODE]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[ORT_GRAPH_OPTIMIZATION_LEVEL]
+    options.enable_cpu_mem_arena = ORT_ENABLE_CPU_MEM_ARENA
+    options.enable_mem_pattern = ORT_ENABLE_MEM_PATTERN
+    return options
+
+def optimized_model_path(model_path: str) -> str:
+    if not ORT_OPTIMIZED_MODEL_DIR:
+        return ""
+    # the level and the onnxruntime version are part of the name, a graph optimized for another setup is not reused
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(ORT_OPTIMIZED_MODEL_DIR, f"{name}.{ORT_GRAPH_OPTIMIZATION_LEVEL}.ort-{ort.__version__}.onnx")
+
+def create_session(model_path: str) -> ort.InferenceSession:
+    optimized_path = optimized_model_path(model_path)
+    if optimized_path and os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path):
+        options = session_options()
+        # the saved graph is already optimized, so loading it skips the optimization passes
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            session = ort.InferenceSession(optimized_path, sess_options=options, providers=['CPUExecutionProvider'])
+            logger.info(f"Loaded optimized model from {optimized_path}")
+            return session
+        except Exception as e:
+            logger.warning(f"Failed to load optimized model {optimized_path}, optimizing {model_path} again: {str(e)}")
+
+    options = session_options()
+    temp_path = ""
+    if optimized_path:
+        try:
+            os.makedirs(ORT_OPTIMIZED_MODEL_DIR, exist_ok=True)
+            # written under a temporary name and renamed, so another process never loads a partial file
+            temp_path = f"{optimized_path}.{os.getpid()}.tmp"
+            options.optimized_model_filepath = temp_path
+        except OSError as e:
+            logger.warning(f"Cannot save optimized models to {ORT_OPTIMIZED_MODEL_DIR}: {str(e)}")
+    session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+    if temp_path and os.path.exists(temp_path):
+        os.replace(temp_path, optimized_path)
+        logger.info(f"Saved optimized model to {optimized_path}")
+    return session
+
+def static_shape(shape) -> bool:
+    return all(isinstance(dim, int) and dim > 0 for dim in shape)
+
+class BoundSession:
+    def __init__(self, session: ort.InferenceSession):
+        self.session = session
+        self.input = session.get_inputs()[0]
+        self.outputs = session.get_outputs()
+        self.output_names = [output.name for output in self.outputs]
+        # the original RFB-320 and FER+ exports have a static batch of 1, the converted models a symbolic one
+        batch_dim = self.input.shape[0] if self.input.shape else None
+        self.fixed_batch_size: Optional[int] = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
+        self.binding = None
+        self.lock = threading.Lock()
+        tensors = [self.input] + self.outputs
+        # only single-input float models with a fully static shape get preallocated buffers
+        if ORT_IO_BINDING and len(session.get_inputs()) == 1 and all(
+                static_shape(tensor.shape) and tensor.type == "tensor(float)" for tensor in tensors):
+            self.input_buffer = np.empty(self.input.shape, dtype=np.float32)
+            self.output_buffers = [np.empty(output.shape, dtype=np.float32) for output in self.outputs]
+            self.binding = session.io_binding()
+            self.binding.bind_ortvalue_input(self.input.name, ort.OrtValue.ortvalue_from_numpy(self.input_buffer))
+            for output, buffer in zip(self.outputs, self.output_buffers):
+                self.binding.bind_ortvalue_output(output.name, ort.OrtValue.ortvalue_from_numpy(buffer))
+
+    def run(self, batch: np.ndarray) -> List[np.ndarray]:
+        # a call that finds the buffers busy runs unbound instead of waiting for them
+        if self.binding is None or batch.shape != self.input_buffer.shape or not self.lock.acquire(blocking=False):
+            return self.session.run(self.output_names, {self.input.name: batch})
+        try:
+            self.input_buffer[...] = batch
+            self.session.run_with_iobinding(self.binding)
+            return [buffer.copy() for buffer in self.output_buffers]
+        finally:
+            self.lock.release()
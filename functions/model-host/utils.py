@@ -0,0 +1,129 @@
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+def compute_iou(box, boxes):
+    intersection = np.maximum(0, np.minimum(box[2:], boxes[:, 2:]) - np.maximum(box[:2], boxes[:, :2]))
+    intersection_area = np.prod(intersection, axis=1)
+    area1 = (box[2] - box[0]) * (box[3] - box[1])
+    area2 = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    iou = intersection_area / (area1 + area2 - intersection_area)
+    return iou
+
+def hard_nms(boxes, iou_threshold, top_k=-1):
+    # boxes are sorted by descending score; each step drops every remaining box the current best overlaps
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    remaining = np.arange(len(boxes))
+    keep = []
+    while remaining.size > 0:
+        best, rest = remaining[0], remaining[1:]
+        keep.append(best)
+        if len(keep) == top_k:
+            break
+        width = np.maximum(0, np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]))
+        height = np.maximum(0, np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]))
+        intersection = width * height
+        ious = intersection / (areas[best] + areas[rest] - intersection)
+        remaining = rest[ious < iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+def nms(boxes, scores, iou_threshold, top_k=-1, candidate_size=-1):
+    sorted_indices = np.argsort(scores)[::-1]
+    if candidate_size > 0:
+        sorted_indices = sorted_indices[:candidate_size]
+    return sorted_indices[hard_nms(boxes[sorted_indices], iou_threshold, top_k)]
+
+def clip_box(box, width: int, height: int) -> List[int]:
+    # the detector's boxes can reach past the image edge; crops and reported boxes both use the clipped box
+    return [int(value) for value in np.clip(box, 0, [width, height, width, height])]
+
+# detector input buffers shared by all request threads, reused by any call with the same batch shape; the HTTP server
+# runs each connection on its own thread, so a buffer per thread would only be reused within one keep-alive connection
+INPUT_BUFFER_POOL_SIZE = 4
+_free_buffers: List[np.ndarray] = []
+_free_buffers_lock = threading.Lock()
+
+@contextmanager
+def input_buffer(shape: Tuple[int, ...]):
+    # the buffer is the caller's until the with block ends, then it goes back to the pool
+    with _free_buffers_lock:
+        index = next((i for i, buffer in enumerate(_free_buffers) if buffer.shape == shape), None)
+        buffer = _free_buffers.pop(index) if index is not None else None
+    if buffer is None:
+        buffer = np.empty(shape, dtype=np.float32)
+    try:
+        yield buffer
+    finally:
+        with _free_buffers_lock:
+            _free_buffers.append(buffer)
+            # the least recently returned buffer is dropped once the pool is full
+            del _free_buffers[:-INPUT_BUFFER_POOL_SIZE]
+
+def preprocess_detector(images: List[np.ndarray], size: Tuple[int, int], method: str = "buffer", out: Optional[np.ndarray] = None) -> np.ndarray:
+    # (image - 127.5) / 128 in RGB, NCHW float32; "buffer" writes into out, a buffer from input_buffer, or a new array
+    width, height = size
+    if method == "blob":
+        return cv2.dnn.blobFromImages(images, 1 / 128, size, (127.5, 127.5, 127.5), swapRB=True)
+    batch = out if out is not None else np.empty((len(images), 3, height, width), dtype=np.float32)
+    for i, image in enumerate(images):
+        # resizing the uint8 image first keeps the float work at the model resolution, and reversing
+        # the channels of the CHW view does the BGR to RGB swap while writing into the buffer
+        resized = cv2.resize(image, size)
+        np.subtract(resized.transpose(2, 0, 1)[::-1], np.float32(127.5), out=batch[i], dtype=np.float32)
+    batch *= np.float32(1 / 128)
+    return batch
+
+def detector_input_size(shape) -> Tuple[int, int]:
+    # RFB-320 takes 320x240 and RFB-640 640x480, a fixed NCHW input shape tells which one is loaded
+    if len(shape) == 4 and isinstance(shape[2], int) and isinstance(shape[3], int):
+        return shape[3], shape[2]
+    return 320, 240
+
+def window_starts(length: int, tile: int, overlap: float) -> List[int]:
+    if length <= tile:
+        return [0]
+    step = max(1, int(tile * (1 - overlap)))
+    return list(range(0, length - tile, step)) + [length - tile]
+
+def tile_windows(width: int, height: int, tile_size: Tuple[int, int], overlap: float, max_tiles: int) -> List[Tuple[int, int, int, int]]:
+    # overlapping (x1, y1, x2, y2) windows covering the image, grown until there are at most max_tiles of them
+    tile_width, tile_height = tile_size
+    while True:
+        xs, ys = window_starts(width, tile_width, overlap), window_starts(height, tile_height, overlap)
+        if len(xs) * len(ys) <= max_tiles or (tile_width >= width and tile_height >= height):
+            break
+        tile_width, tile_height = int(tile_width * 1.25), int(tile_height * 1.25)
+    return [(x, y, min(x + tile_width, width), min(y + tile_height, height)) for y in ys for x in xs]
+
+def detection_windows(width: int, height: int, input_size: Tuple[int, int], mode: str, tile_scale: float, tile_overlap: float,
+                      max_tiles: int, adaptive_scale_threshold: float, adaptive_large_mode: str) -> List[Tuple[int, int, int, int]]:
+    input_width, input_height = input_size
+    if mode == "adaptive":
+        # small faces in an image shrunk by more than the threshold fall below what the detector can find
+        downscale = max(width / input_width, height / input_height)
+        mode = adaptive_large_mode if downscale > adaptive_scale_threshold else "single"
+    if mode == "single":
+        return [(0, 0, width, height)]
+    tiles = tile_windows(width, height, (int(input_width * tile_scale), int(input_height * tile_scale)), tile_overlap, max_tiles)
+    if len(tiles) == 1:
+        return [(0, 0, width, height)]
+    # the whole image catches the faces too large for a single tile
+    return tiles if mode == "tiled" else [(0, 0, width, height)] + tiles
+
+def merge_window_detections(confidences, boxes, windows, prob_threshold, iou_threshold, top_k=-1, candidate_size=-1):
+    # boxes of every window are mapped to image pixels and suppressed together, so a face seen by overlapping windows is kept once
+    window_boxes, window_probs = [], []
+    for window_confidences, window_anchors, (x1, y1, x2, y2) in zip(confidences, boxes, windows):
+        probs = window_confidences[:, 1]
+        mask = probs > prob_threshold
+        window_boxes.append(window_anchors[mask] * np.array([x2 - x1, y2 - y1, x2 - x1, y2 - y1]) + np.array([x1, y1, x1, y1]))
+        window_probs.append(probs[mask])
+    merged_boxes, merged_probs = np.concatenate(window_boxes), np.concatenate(window_probs)
+    if merged_probs.shape[0] == 0:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0)
+    keep = nms(merged_boxes, merged_probs, iou_threshold, top_k=top_k, candidate_size=candidate_size)
+    return merged_boxes[keep].astype(np.int32), merged_probs[keep]
@@ -0,0 +1,76 @@
+import json
+import struct
+from typing import Any, List
+
+# frame layout: MAGIC | uint32 header length | JSON header | raw segments back to back
+MAGIC = b"FAF1"
+CONTENT_TYPE = "application/x-faas-frame"
+JSON_CONTENT_TYPE = "application/json"
+SEGMENT_KEY = "$seg"
+
+_HEADER = struct.Struct(">4sI")
+
+def is_frame(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+def _escape(key: Any) -> Any:
+    # payload keys starting with "$" get one more, so only segment references have a lone "$seg" key
+    return "$" + key if isinstance(key, str) and key.startswith("$") else key
+
+def _unescape(key: str) -> str:
+    return key[1:] if key.startswith("$") else key
+
+def _extract(obj: Any, segments: List[bytes]) -> Any:
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        segments.append(obj)
+        return {SEGMENT_KEY: len(segments) - 1}
+    if isinstance(obj, dict):
+        return {_escape(key): _extract(value, segments) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_extract(value, segments) for value in obj]
+    return obj
+
+def _restore(obj: Any, segments: List[bytes]) -> Any:
+    if isinstance(obj, dict):
+        if len(obj) == 1 and SEGMENT_KEY in obj:
+            return segments[obj[SEGMENT_KEY]]
+        return {_unescape(key): _restore(value, segments) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_restore(value, segments) for value in obj]
+    return obj
+
+def encode(obj: Any) -> bytes:
+    segments: List[bytes] = []
+    body = _extract(obj, segments)
+    header = json.dumps({"body": body, "segments": [len(segment) for segment in segments]}).encode('utf-8')
+    return b"".join([_HEADER.pack(MAGIC, len(header)), header, *segments])
+
+def decode(data: bytes) -> Any:
+    magic, header_length = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary frame")
+    offset = _HEADER.size + header_length
+    header = json.loads(data[_HEADER.size:offset].decode('utf-8'))
+
+    segments = []
+    for length in header["segments"]:
+        if offset + length > len(data):
+            raise ValueError("Truncated binary frame")
+        segments.append(bytes(data[offset:offset + length]))
+        offset += length
+    return _restore(header["body"], segments)
+
+def to_json(obj: Any) -> bytes:
+    # JSON clients keep receiving binary fields hex-encoded
+    def default(value: Any) -> Any:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value).hex()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    return json.dumps(obj, default=default).encode('utf-8')
+
+def loads(data: bytes) -> Any:
+    return decode(data) if is_frame(data) else json.loads(data.decode('utf-8'))
+
+def content_type(data: bytes) -> str:
+    return CONTENT_TYPE if is_frame(data) else JSON_CONTENT_TYPE
@@ -1,62 +1,39 @@
 import json
+import os
 import sys
 import logging
-from typing import Dict, List, Any
 
-import numpy as np
-import onnxruntime as ort
-from transformers import AutoTokenizer
+from engine import register_engines
+from model_specs import MODEL_SPECS
+from metrics import timed
+from registry import ModelRegistry
+from server import SERVER_MODE, serve
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-MODEL_PATH = "improved_sentiment_classifier-int8.onnx"
-TOKENIZER_NAME = "microsoft/xtremedistil-l6-h384-uncased"
-EMOTIONS = [
-    'admiration', 'amusement', 'anger', 'annoyance', 'approval', 'caring',
-    'confusion', 'curiosity', 'desire', 'disappointment', 'disapproval',
-    'disgust', 'embarrassment', 'excitement', 'fear', 'gratitude', 'grief',
-    'joy', 'love', 'nervousness', 'optimism', 'pride', 'realization',
-    'relief', 'remorse', 'sadness', 'surprise', 'neutral'
-]
-MAX_LENGTH = 64
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "multi-label-sentiment-analysis")
+# one container can host several text models, requests pick one with {"model": "<name>"}
+TEXT_MODELS = [name.strip() for name in os.getenv("TEXT_MODELS", DEFAULT_MODEL).split(",") if name.strip()]
+# models not listed here are loaded on their first request
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", DEFAULT_MODEL).split(",") if name.strip() in TEXT_MODELS]
 
-tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, use_fast=True)
-session = ort.InferenceSession(MODEL_PATH, providers=['CPUExecutionProvider'])
-
-def sigmoid(x: np.ndarray) -> np.ndarray:
-    return 1 / (1 + np.exp(-x))
-
-def process_text(text: str) -> Dict[str, List[Dict[str, Any]]]:
-    inputs = tokenizer(text, return_tensors="np", padding="max_length", truncation=True, max_length=MAX_LENGTH)
-    
-    ort_inputs = {
-        "input_ids": inputs["input_ids"],
-        "attention_mask": inputs["attention_mask"]
-    }
-    
-    logits = session.run(None, ort_inputs)[0]
-    probabilities = sigmoid(logits)[0]
-    
-    top_emotions = np.argsort(probabilities)[-3:][::-1]
-    
-    return {
-        "result": [
-            {"emotion": EMOTIONS[i], "probability": float(probabilities[i])}
-            for i in top_emotions
-        ]
-    }
+registry = ModelRegistry()
+register_engines(registry, MODEL_SPECS, TEXT_MODELS)
+registry.preload(PRELOAD_MODELS)
 
 def handle(req: str) -> str:
     try:
-        input_data = json.loads(req)
-        text = input_data.get("text", "")
+        with timed("deserialize"):
+            input_data = json.loads(req)
         
-        if not text:
-            return json.dumps({"error": "No text provided"})
+        model = input_data.get("model", DEFAULT_MODEL)
+        if model not in registry:
+            return json.dumps({"error": f"Unknown model: {model}, this function serves {', '.join(registry.names())}"})
         
-        result = process_text(text)
-        return json.dumps(result)
+        result = registry.get(model).infer(input_data)
+        with timed("serialize"):
+            return json.dumps(result)
     
     except json.JSONDecodeError as e:
         return json.dumps({"error": f"Invalid JSON input: {str(e)}"})
@@ -65,6 +42,9 @@ def handle(req: str) -> str:
         return json.dumps({"error": f"An unexpected error occurred: {str(e)}"})
 
 if __name__ == "__main__":
-    for line in sys.stdin:
-        ret = handle(line)
-        print(ret, flush=True)
\ No newline at end of file
+    if SERVER_MODE == "http":
+        serve(handle, stats=lambda: {"registry": registry.stats(), "models": {name: engine.stats() for name, engine in registry.loaded().items()}})
+    else:
+        for line in sys.stdin:
+            ret = handle(line)
+            print(ret, flush=True)
\ No newline at end of file
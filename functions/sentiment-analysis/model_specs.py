@@ -0,0 +1,33 @@
+from engine import ModelSpec
+
+MODEL_SPECS = {spec.name: spec for spec in [
+    ModelSpec(
+        name="sentiment-analysis",
+        model_path="classifier_int8.onnx",
+        tokenizer_name="microsoft/xtremedistil-l6-h256-uncased",
+        labels=['sadness', 'joy', 'love', 'anger', 'fear', 'surprise'],
+        max_length=128
+    ),
+    ModelSpec(
+        name="multi-label-sentiment-analysis",
+        model_path="improved_sentiment_classifier-int8.onnx",
+        tokenizer_name="microsoft/xtremedistil-l6-h384-uncased",
+        labels=[
+            'admiration', 'amusement', 'anger', 'annoyance', 'approval', 'caring',
+            'confusion', 'curiosity', 'desire', 'disappointment', 'disapproval',
+            'disgust', 'embarrassment', 'excitement', 'fear', 'gratitude', 'grief',
+            'joy', 'love', 'nervousness', 'optimism', 'pride', 'realization',
+            'relief', 'remorse', 'sadness', 'surprise', 'neutral'
+        ],
+        max_length=64,
+        activation="sigmoid"
+    ),
+    ModelSpec(
+        name="text-classification",
+        model_path="text_classifier_int8.onnx",
+        tokenizer_name="microsoft/xtremedistil-l6-h256-uncased",
+        labels=["World", "Sports", "Business", "Sci/Tech"],  # the AG News dataset labels
+        max_length=128,
+        output="class"
+    ),
+]}
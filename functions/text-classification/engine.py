@@ -0,0 +1,249 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import numpy as np
+from transformers import AutoTokenizer
+
+from batcher import MicroBatcher
+from lru_cache import LRUCache, hash_key
+from metrics import timed
+from ort_session import create_session
+from registry import ModelRegistry, model_size
+
+logger = logging.getLogger(__name__)
+
+BATCHING_ENABLED = os.getenv("BATCHING_ENABLED", "true").lower() == "true"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 32))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 5))
+# the most sequences one session run takes; a micro-batch or a large request is run in chunks of this size
+INFERENCE_CHUNK_SIZE = int(os.getenv("INFERENCE_CHUNK_SIZE", 64))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 10000))
+# batches are padded up to the smallest bucket that fits their longest sequence; empty pads to the exact length
+SEQUENCE_BUCKETS = [int(b) for b in os.getenv("SEQUENCE_BUCKETS", "16,32,64,128").split(",") if b.strip()]
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# the batch sizes each sequence bucket is warmed up with, by default a single text, a full micro-batch and a full chunk
+WARMUP_BATCH_SIZES = sorted({int(b) for b in os.getenv("WARMUP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE},{INFERENCE_CHUNK_SIZE}").split(",") if b.strip()})
+# texts longer than a model's max_length are either truncated or split into overlapping windows
+LONG_TEXT_MODE = os.getenv("LONG_TEXT_MODE", "truncate")
+WINDOW_STRIDE = int(os.getenv("WINDOW_STRIDE", 32))
+MAX_WINDOWS = int(os.getenv("MAX_WINDOWS", 16))
+
+@dataclass(frozen=True)
+class ModelSpec:
+    name: str
+    model_path: str
+    tokenizer_name: str
+    labels: List[str]
+    max_length: int
+    # softmax for single-label models, sigmoid for multi-label ones
+    activation: str = "softmax"
+    # "top_k" answers {"result": [{"emotion", "probability"}, ...]}, "class" answers the predicted class and all probabilities
+    output: str = "top_k"
+    top_k: int = 3
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    e_x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e_x / e_x.sum(axis=-1, keepdims=True)
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+def model_path(spec: ModelSpec) -> str:
+    # MODEL_PATH_<NAME> lets an image that bundles several models keep them anywhere
+    return os.getenv(f"MODEL_PATH_{spec.name.upper().replace('-', '_')}", spec.model_path)
+
+class TextEngine:
+    def __init__(self, spec: ModelSpec):
+        start = time.perf_counter()
+        self.spec = spec
+        self.tokenizer = AutoTokenizer.from_pretrained(spec.tokenizer_name, use_fast=True)
+        self.session = create_session(model_path(spec))
+        # models differ in whether they take token_type_ids, so the feed is built from what the graph declares
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.activation = sigmoid if spec.activation == "sigmoid" else softmax
+        self.buckets = sorted({min(bucket, spec.max_length) for bucket in SEQUENCE_BUCKETS})
+        self.token_cache = LRUCache(TOKEN_CACHE_SIZE, name=f"{spec.name}-tokens")
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE, name=f"{spec.name}-results")
+        self.batcher = MicroBatcher(self.predict_sequences_batches, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, item_size=len, name=spec.name) if BATCHING_ENABLED else None
+        self.load_seconds = time.perf_counter() - start
+        self.warmup_seconds = 0.0
+        if WARMUP_ENABLED:
+            self.warm_up()
+
+    def tokenize(self, texts: List[str]) -> List[List[np.ndarray]]:
+        if LONG_TEXT_MODE != "window":
+            encoded = self.tokenizer(texts, truncation=True, max_length=self.spec.max_length)["input_ids"]
+            return [[np.array(input_ids, dtype=np.int64)] for input_ids in encoded]
+
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.spec.max_length, stride=WINDOW_STRIDE, return_overflowing_tokens=True)
+        windows = [[] for _ in texts]
+        for input_ids, text_index in zip(encoded["input_ids"], encoded["overflow_to_sample_mapping"]):
+            if len(windows[text_index]) < MAX_WINDOWS:
+                windows[text_index].append(np.array(input_ids, dtype=np.int64))
+        return windows
+
+    def encode_texts(self, texts: List[str]) -> List[List[np.ndarray]]:
+        keys = [hash_key(text.encode('utf-8')) for text in texts]
+        windows = [self.token_cache.get(key) for key in keys]
+        missing = [i for i, text_windows in enumerate(windows) if text_windows is None]
+        if missing:
+            for i, text_windows in zip(missing, self.tokenize([texts[i] for i in missing])):
+                windows[i] = text_windows
+                self.token_cache.set(keys[i], text_windows)
+        return windows
+
+    def parse_token_input(self, input_ids: List[List[int]], attention_mask: List[List[int]]) -> List[np.ndarray]:
+        # pre-tokenized requests skip the tokenizer; padding positions are dropped using the attention mask
+        if len(attention_mask) != len(input_ids) or any(len(mask) != len(row) for row, mask in zip(input_ids, attention_mask)):
+            raise ValueError("\"attention_mask\" must have the same shape as \"input_ids\"")
+        sequences = []
+        for row, mask in zip(input_ids, attention_mask):
+            sequence = np.array(row, dtype=np.int64)[np.array(mask, dtype=bool)]
+            if not 0 < sequence.size <= self.spec.max_length:
+                raise ValueError(f"Every sequence must have between 1 and {self.spec.max_length} tokens")
+            if sequence.min() < 0 or sequence.max() >= len(self.tokenizer):
+                raise ValueError("\"input_ids\" contains ids outside of the tokenizer vocabulary")
+            sequences.append(sequence)
+        return sequences
+
+    def padded_length(self, length: int) -> int:
+        return next((bucket for bucket in self.buckets if bucket >= length), length)
+
+    def pad_sequences(self, sequences: List[np.ndarray]) -> Dict[str, np.ndarray]:
+        length = self.padded_length(max(len(sequence) for sequence in sequences))
+        input_ids = np.full((len(sequences), length), self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), length), dtype=np.int64)
+        for row, sequence in enumerate(sequences):
+            input_ids[row, :len(sequence)] = sequence
+            attention_mask[row, :len(sequence)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+        return {name: feed[name] for name in self.input_names}
+
+    def predict_sequences(self, sequences: List[np.ndarray]) -> np.ndarray:
+        # sequences of similar length are batched together so short texts are not padded up to long ones
+        order = np.argsort([len(sequence) for sequence in sequences], kind="stable")
+        probabilities = np.empty((len(sequences), len(self.spec.labels)), dtype=np.float32)
+        for start in range(0, len(order), INFERENCE_CHUNK_SIZE):
+            indices = order[start:start + INFERENCE_CHUNK_SIZE]
+            logits = self.session.run(None, self.pad_sequences([sequences[i] for i in indices]))[0]
+            probabilities[indices] = self.activation(logits)
+        return probabilities
+
+    def predict_sequences_batches(self, batches: List[List[np.ndarray]]) -> List[np.ndarray]:
+        probabilities = self.predict_sequences([sequence for sequences in batches for sequence in sequences])
+        split_probabilities, offset = [], 0
+        for sequences in batches:
+            split_probabilities.append(probabilities[offset:offset + len(sequences)])
+            offset += len(sequences)
+        return split_probabilities
+
+    def aggregate_windows(self, probabilities: np.ndarray) -> np.ndarray:
+        # multi-label scores are independent, so a label found in any window counts for the whole text
+        if self.spec.activation == "sigmoid":
+            return np.max(probabilities, axis=0)
+        return np.mean(probabilities, axis=0)
+
+    def format_result(self, probabilities: np.ndarray) -> Dict[str, Any]:
+        labels = self.spec.labels
+        if self.spec.output == "class":
+            predicted_class_id = np.argmax(probabilities)
+            return {
+                "class": labels[predicted_class_id],
+                "class_id": int(predicted_class_id),
+                "probability": float(probabilities[predicted_class_id]),
+                "probabilities": {label: float(prob) for label, prob in zip(labels, probabilities)}
+            }
+        top_labels = np.argsort(probabilities)[-self.spec.top_k:][::-1]
+        return {
+            "result": [
+                {"emotion": labels[i], "probability": float(probabilities[i])}
+                for i in top_labels
+            ]
+        }
+
+    def run_sequences(self, sequences: List[np.ndarray]) -> List[np.ndarray]:
+        # repeated inputs are answered from the result cache and never reach the batcher
+        keys = [hash_key(sequence.tobytes()) for sequence in sequences]
+        probabilities = [self.result_cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(probabilities) if result is None]
+        if missing:
+            pending = [sequences[i] for i in missing]
+            with timed("inference"):
+                computed = self.predict_sequences(pending) if self.batcher is None else self.batcher.run(pending)
+            for i, result in zip(missing, computed):
+                probabilities[i] = result
+                self.result_cache.set(keys[i], result)
+        return probabilities
+
+    def run_texts(self, texts: List[str]) -> List[Dict[str, Any]]:
+        with timed("tokenize"):
+            windows = self.encode_texts(texts)
+        probabilities = self.run_sequences([sequence for text_windows in windows for sequence in text_windows])
+        results, offset = [], 0
+        with timed("postprocess"):
+            for text_windows in windows:
+                results.append(self.format_result(self.aggregate_windows(probabilities[offset:offset + len(text_windows)])))
+                offset += len(text_windows)
+        return results
+
+    def infer(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        if "input_ids" in input_data:
+            input_ids = input_data["input_ids"]
+            if not isinstance(input_ids, list) or not input_ids:
+                return {"error": "\"input_ids\" must be a non-empty list"}
+            single = not isinstance(input_ids[0], list)
+            attention_mask = input_data.get("attention_mask") or ([1] * len(input_ids) if single else [[1] * len(row) for row in input_ids])
+            try:
+                sequences = self.parse_token_input([input_ids], [attention_mask]) if single else self.parse_token_input(input_ids, attention_mask)
+            except (TypeError, ValueError) as e:
+                return {"error": f"Invalid token input: {str(e)}"}
+            probabilities = self.run_sequences(sequences)
+            with timed("postprocess"):
+                results = [self.format_result(text_probabilities) for text_probabilities in probabilities]
+            return results[0] if single else {"results": results}
+
+        if "texts" in input_data:
+            texts = input_data["texts"]
+            if not isinstance(texts, list) or not texts or not all(isinstance(t, str) and t for t in texts):
+                return {"error": "\"texts\" must be a non-empty list of non-empty strings"}
+            return {"results": self.run_texts(texts)}
+
+        text = input_data.get("text", "")
+        if not text:
+            return {"error": "No text provided"}
+        return self.run_texts([text])[0]
+
+    def warm_up(self):
+        # one run per bucket and batch size so the first request of each shape does not pay for allocations
+        start = time.perf_counter()
+        for length in self.buckets or [self.spec.max_length]:
+            for batch_size in WARMUP_BATCH_SIZES:
+                self.predict_sequences([np.full(length, self.tokenizer.pad_token_id, dtype=np.int64)] * batch_size)
+        self.warmup_seconds = time.perf_counter() - start
+        logger.info(f"Warmed up {self.spec.name} for sequence buckets {self.buckets or [self.spec.max_length]} "
+                    f"and batch sizes {WARMUP_BATCH_SIZES} in {self.warmup_seconds:.2f}s")
+
+    def close(self):
+        # an evicted engine drains its queued requests before the session is dropped
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "batcher": self.batcher.stats() if self.batcher is not None else {},
+            "token_cache": self.token_cache.stats(),
+            "result_cache": self.result_cache.stats()
+        }
+
+def register_engines(registry: ModelRegistry, specs: Dict[str, ModelSpec], names: List[str]):
+    unknown = [name for name in names if name not in specs]
+    if unknown:
+        raise ValueError(f"Unknown text models: {', '.join(unknown)}")
+    for name in names:
+        registry.register(name, lambda spec=specs[name]: TextEngine(spec), model_size(model_path(specs[name])))
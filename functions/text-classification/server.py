@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Union
+from urllib.parse import urlparse
+
+from batcher import request_deadline
+from metrics import METRICS_PATH, SERVER_TIMING_HEADER, TRACEPARENT_HEADER, finish_trace, render, start_trace
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODE = os.getenv("mode", "streaming")
+SERVER_PORT = urlparse(os.getenv("upstream_url", "http://127.0.0.1:5000")).port or 5000
+HEALTH_PATH = "/_/health"
+STATS_PATH = "/_/stats"
+# relative budget in seconds the orchestrator forwards with every call
+DEADLINE_HEADER = "X-Request-Timeout"
+DEADLINE_EXCEEDED = b'{"error": "Request deadline exceeded"}'
+# with suppress_lock the watchdog leaves the lock file, and so the readiness probe, to the function
+LOCK_FILE = os.getenv("LOCK_FILE", "/tmp/.lock")
+
+# path of the request being handled, what the gateway forwards after /function/<name>
+request_path: ContextVar[str] = ContextVar("request_path", default="/")
+
+Handler = Callable[[bytes], Union[bytes, str]]
+StatsProvider = Callable[[], Dict[str, Any]]
+ResponseType = Callable[[bytes], str]
+
+def make_request_handler(handle: Handler, stats: Optional[StatsProvider] = None,
+                         response_type: Optional[ResponseType] = None) -> type:
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are separate writes, without TCP_NODELAY the body waits for the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == HEALTH_PATH:
+                self.respond(200, b"OK", "text/plain")
+            elif path == STATS_PATH:
+                self.respond(200, json.dumps(stats() if stats else {}).encode('utf-8'), "application/json")
+            elif path == METRICS_PATH:
+                body, content_type = render(self.headers.get("Accept"))
+                self.respond(200, body, content_type)
+            else:
+                self.invoke(b"")
+
+        def parse_request(self) -> bool:
+            # the budget counts from when the request arrived, reading a large body is part of it
+            self.received = time.monotonic()
+            return super().parse_request()
+
+        def do_POST(self):
+            self.invoke(self.read_body())
+
+        do_PUT = do_POST
+
+        def read_body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";", 1)[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b"".join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def invoke(self, body: bytes):
+            # the stages timed by the handler are reported back in a Server-Timing header
+            trace = start_trace(self.headers.get(TRACEPARENT_HEADER))
+            deadline = self.deadline()
+            request_deadline.set(deadline)
+            request_path.set(self.path.split("?", 1)[0])
+            if deadline is not None and deadline <= time.monotonic():
+                finish_trace(trace)
+                self.respond(504, DEADLINE_EXCEEDED, "application/json")
+                return
+            try:
+                result = handle(body)
+            except Exception as e:
+                logger.error(f"Unhandled error in handler: {str(e)}", exc_info=True)
+                finish_trace(trace)
+                self.respond(500, b'{"error": "Internal server error"}', "application/json")
+                return
+            finish_trace(trace)
+            # the caller has stopped waiting, so a late result is reported the same way as an expired request
+            if deadline is not None and deadline <= time.monotonic():
+                self.respond(504, DEADLINE_EXCEEDED, "application/json")
+                return
+            if isinstance(result, str):
+                result = result.encode('utf-8')
+            self.respond(200, result, response_type(result) if response_type else "application/json",
+                         {SERVER_TIMING_HEADER: trace.server_timing()} if trace.stages else None)
+
+        def deadline(self) -> Optional[float]:
+            timeout = self.headers.get(DEADLINE_HEADER)
+            if not timeout:
+                return None
+            try:
+                return self.received + float(timeout)
+            except ValueError:
+                logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {timeout}")
+                return None
+
+        def respond(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return RequestHandler
+
+def mark_ready(ready: bool = True):
+    if ready:
+        with open(LOCK_FILE, "w"):
+            pass
+        logger.info(f"Ready, wrote {LOCK_FILE}")
+    elif os.path.exists(LOCK_FILE):
+        os.remove(LOCK_FILE)
+
+def serve(handle: Handler, port: int = SERVER_PORT, stats: Optional[StatsProvider] = None,
+          response_type: Optional[ResponseType] = None):
+    server = ThreadingHTTPServer(("0.0.0.0", port), make_request_handler(handle, stats, response_type))
+    server.daemon_threads = True
+    logger.info(f"Serving requests on port {port}")
+    # models are loaded and warmed up before serve is called, so the function is ready once the port is bound
+    mark_ready()
+    try:
+        server.serve_forever()
+    finally:
+        mark_ready(False)
+        server.server_close()
@@ -0,0 +1,243 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "functions", "face-detection"))
+from utils import compute_iou, nms  # noqa: E402
+
+FUNCTIONS_DIR = os.path.join(ROOT, "functions")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DETECTION_THRESHOLD = 0.8
+
+def preprocess_detector(image):
+    rgb_image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (320, 240))
+    return np.transpose((rgb_image - 127.5) / 128, [2, 0, 1])[np.newaxis].astype(np.float32)
+
+def preprocess_detector_640(image):
+    rgb_image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (640, 480))
+    return np.transpose((rgb_image - 127.5) / 128, [2, 0, 1])[np.newaxis].astype(np.float32)
+
+def preprocess_emotion(image):
+    gray_image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (64, 64))
+    return gray_image[np.newaxis, np.newaxis].astype(np.float32)
+
+def preprocess_gender(image):
+    return cv2.dnn.blobFromImages([image], 1.0, (224, 224), (104, 117, 123), swapRB=False)
+
+# (function directory, fp32 file, preprocessing, task) for every face model
+MODELS = {
+    "face-detection": ("face-detection", "version-RFB-320.onnx", preprocess_detector, "detection"),
+    "face-detection-640": ("face-detection", "version-RFB-640.onnx", preprocess_detector_640, "detection"),
+    "face-emotion-detection": ("face-emotion-detection", "emotion-ferplus-8.onnx", preprocess_emotion, "classification"),
+    "face-gender-detection": ("face-gender-detection", "gender_googlenet.onnx", preprocess_gender, "classification"),
+}
+
+def int8_name(fp32_name):
+    return fp32_name.replace(".onnx", "-int8.onnx")
+
+def dynamic_name(fp32_name):
+    return fp32_name.replace(".onnx", "-dynamic.onnx")
+
+def load_images(directory, limit):
+    if not directory:
+        return []
+    paths = sorted(path for path in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                   if path.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+    return [image for image in images if image is not None]
+
+def convert_gender(prototxt, caffemodel, output_path):
+    # caffe2onnx maps the GoogLeNet layers (Conv, LRN, Pooling, Concat, InnerProduct, Softmax) one to one
+    subprocess.run([sys.executable, "-m", "caffe2onnx.convert", "--prototxt", prototxt, "--caffemodel", caffemodel,
+                    "--onnx", output_path], check=True)
+    print(f"Converted {caffemodel} to {output_path}")
+
+def make_batch_dynamic(input_path, output_path):
+    # a symbolic batch dimension lets the micro-batchers send a whole batch in one run instead of slicing it
+    model = onnx.load(input_path)
+    initializers = {initializer.name for initializer in model.graph.initializer}
+    graph_inputs = [graph_input for graph_input in model.graph.input if graph_input.name not in initializers]
+    fixed_batch_size = graph_inputs[0].type.tensor_type.shape.dim[0].dim_value
+    for tensor in graph_inputs + list(model.graph.output):
+        tensor.type.tensor_type.shape.dim[0].dim_param = "batch"
+    del model.graph.value_info[:]
+
+    # Reshape targets written for the exported batch size copy the batch dimension from their input instead
+    shape_inputs = {node.input[1] for node in model.graph.node if node.op_type == "Reshape"}
+    shape_tensors = [initializer for initializer in model.graph.initializer if initializer.name in shape_inputs]
+    shape_tensors += [attribute.t for node in model.graph.node if node.op_type == "Constant" and node.output[0] in shape_inputs
+                      for attribute in node.attribute if attribute.name == "value"]
+    for tensor in shape_tensors:
+        shape = onnx.numpy_helper.to_array(tensor).copy()
+        if fixed_batch_size and shape.ndim == 1 and shape.size and shape[0] == fixed_batch_size:
+            shape[0] = 0
+            tensor.CopyFrom(onnx.numpy_helper.from_array(shape, tensor.name))
+
+    onnx.checker.check_model(model)
+    onnx.save(model, output_path)
+
+def check_batch_dynamic(path, preprocess):
+    # a batch of two has to give the same outputs as two single runs, or a Reshape still holds the old batch size
+    session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+    images = np.random.default_rng(0).integers(0, 255, (2, 480, 640, 3), dtype=np.uint8)
+    singles = [run_model(session, preprocess(image)) for image in images]
+    batched = run_model(session, np.concatenate([preprocess(image) for image in images]))
+    for single, output in zip(zip(*singles), batched):
+        if not np.allclose(np.concatenate(single), output, atol=1e-4):
+            raise RuntimeError(f"{path} gives different outputs for a batch than for single images")
+    print(f"Checked the dynamic batch dimension of {path}")
+
+class ImageCalibrationReader(CalibrationDataReader):
+    def __init__(self, input_name, batches):
+        self.input_name = input_name
+        self.batches = iter(batches)
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+def quantize(fp32_path, int8_path, preprocess, calibration_images):
+    with tempfile.TemporaryDirectory() as work_dir:
+        dynamic_path = os.path.join(work_dir, "dynamic.onnx")
+        prepared_path = os.path.join(work_dir, "prepared.onnx")
+        make_batch_dynamic(fp32_path, dynamic_path)
+        quant_pre_process(dynamic_path, prepared_path)
+        if not calibration_images:
+            # without calibration data only the weights can be quantized, as for the text models
+            print(f"No calibration images, quantizing {fp32_path} dynamically")
+            quantize_dynamic(prepared_path, int8_path, weight_type=QuantType.QUInt8)
+            return
+        input_name = ort.InferenceSession(prepared_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+        reader = ImageCalibrationReader(input_name, [preprocess(image) for image in calibration_images])
+        quantize_static(prepared_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    print(f"Quantized {fp32_path} to {int8_path}")
+
+def run_model(model, batch):
+    # the Caffe gender model the function serves by default runs on cv2.dnn, the ONNX variants on onnxruntime
+    if isinstance(model, cv2.dnn.Net):
+        model.setInput(batch)
+        return [model.forward()]
+    return model.run(None, {model.get_inputs()[0].name: batch})
+
+def detect(session, batch):
+    confidences, boxes = run_model(session, batch)
+    probs = confidences[0][:, 1]
+    mask = probs > DETECTION_THRESHOLD
+    keep = nms(boxes[0][mask], probs[mask], 0.3, top_k=200)
+    return boxes[0][mask][keep]
+
+def detection_recall(reference_boxes, boxes):
+    # share of the fp32 detections that the variant finds again with an IoU of at least 0.5
+    if len(reference_boxes) == 0:
+        return 1.0
+    if len(boxes) == 0:
+        return 0.0
+    return float(np.mean([compute_iou(box, boxes).max() >= 0.5 for box in reference_boxes]))
+
+def time_ms(model, batch, repeat):
+    run_model(model, batch)
+    return float(np.median(timeit.repeat(lambda: run_model(model, batch), number=1, repeat=repeat)) * 1000)
+
+def load_variant(paths):
+    if len(paths) == 2:
+        return cv2.dnn.readNet(paths[1], paths[0])
+    return ort.InferenceSession(paths[0], providers=['CPUExecutionProvider'])
+
+def compare(name, variants, preprocess, task, images, repeat, reference="fp32"):
+    # every variant is compared with the reference: the fp32 ONNX model, or for gender the Caffe model served by default
+    models = {variant: load_variant(paths) for variant, paths in variants.items()}
+    sample = images[0] if images else np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    rows = []
+    for variant, model in models.items():
+        row = {
+            "model": name, "variant": variant,
+            "size_mb": sum(os.path.getsize(path) for path in variants[variant]) / 1e6,
+            "latency_ms": time_ms(model, preprocess(sample), repeat),
+        }
+        if images and variant != reference:
+            row["reference"] = reference
+            if task == "detection":
+                row["agreement"] = float(np.mean([detection_recall(detect(models[reference], preprocess(image)), detect(model, preprocess(image)))
+                                                  for image in images]))
+            else:
+                # the top-1 label has to match the reference, the drift of the raw outputs is reported alongside
+                outputs = [(run_model(models[reference], preprocess(image))[0].reshape(-1), run_model(model, preprocess(image))[0].reshape(-1))
+                           for image in images]
+                row["agreement"] = float(np.mean([np.argmax(ref) == np.argmax(out) for ref, out in outputs]))
+                row["max_abs_diff"] = float(max(np.abs(ref - out).max() for ref, out in outputs))
+        rows.append(row)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the face models to ONNX, quantize them to INT8 and compare the variants")
+    parser.add_argument("--models", nargs="+", default=["face-detection", "face-emotion-detection", "face-gender-detection"],
+                        choices=list(MODELS), help="models to process, RFB-640 (face-detection-640) only when listed")
+    parser.add_argument("--output-dir", default="", help="write every model here instead of into its function directory")
+    parser.add_argument("--calibration-dir", default="", help="face images used to calibrate static INT8 quantization")
+    parser.add_argument("--calibration-size", type=int, default=200, help="number of calibration images")
+    parser.add_argument("--eval-dir", default="", help="face images used for the accuracy comparison, defaults to the calibration images")
+    parser.add_argument("--eval-size", type=int, default=200, help="number of evaluation images")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per model variant")
+    parser.add_argument("--report", default="face_model_report.json", help="where to write the comparison report")
+    parser.add_argument("--skip-conversion", action="store_true", help="only compare the variants that already exist")
+    args = parser.parse_args()
+
+    calibration_images = load_images(args.calibration_dir, args.calibration_size)
+    eval_images = load_images(args.eval_dir or args.calibration_dir, args.eval_size)
+    report = []
+    for name in args.models:
+        directory, fp32_name, preprocess, task = MODELS[name]
+        source_dir = os.path.join(FUNCTIONS_DIR, directory)
+        output_dir = args.output_dir or source_dir
+        os.makedirs(output_dir, exist_ok=True)
+        fp32_path = os.path.join(output_dir, fp32_name)
+        dynamic_path = os.path.join(output_dir, dynamic_name(fp32_name))
+        int8_path = os.path.join(output_dir, int8_name(fp32_name))
+
+        caffe_paths = (os.path.join(source_dir, "gender_googlenet.prototxt"), os.path.join(source_dir, "gender_googlenet.caffemodel"))
+        if not args.skip_conversion:
+            if name == "face-gender-detection":
+                convert_gender(*caffe_paths, fp32_path)
+            elif not os.path.exists(fp32_path):
+                shutil.copy(os.path.join(source_dir, fp32_name), fp32_path)
+            # the fp32 model stays as exported, the reference for the report; its dynamic-batch copy is served as fp32-dynamic
+            make_batch_dynamic(fp32_path, dynamic_path)
+            check_batch_dynamic(dynamic_path, preprocess)
+            quantize(fp32_path, int8_path, preprocess, calibration_images)
+
+        variants = {variant: (path,) for variant, path in (("fp32", fp32_path), ("fp32-dynamic", dynamic_path), ("int8", int8_path))
+                    if os.path.exists(path)}
+        reference = "fp32"
+        if name == "face-gender-detection" and all(os.path.exists(path) for path in caffe_paths):
+            # the function serves the Caffe model unless MODEL_VARIANT is set, so the conversion is checked against it
+            variants = {"caffe": caffe_paths, **variants}
+            reference = "caffe"
+        report.extend(compare(name, variants, preprocess, task, eval_images, args.repeat, reference))
+
+    print(f"{'model':<24}{'variant':>14}{'size MB':>10}{'latency ms':>12}{'agreement':>11}{'vs':>7}")
+    for row in report:
+        agreement = f"{row['agreement']:.3f}" if "agreement" in row else "-"
+        print(f"{row['model']:<24}{row['variant']:>14}{row['size_mb']:>10.2f}{row['latency_ms']:>12.3f}{agreement:>11}{row.get('reference', '-'):>7}")
+    with open(args.report, "w") as f:
+        json.dump({"calibration_images": len(calibration_images), "eval_images": len(eval_images), "results": report}, f, indent=2)
+    print(f"Report written to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,185 @@
-import json
 import hashlib
-import redis
-from config import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_TTL
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+import wire
+from logger import logger
+from metrics import count_cache_lookup
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_TTL, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT, REDIS_ERROR_BACKOFF,
+    CACHE_LOCAL_MAX_ENTRIES, CACHE_LOCAL_MAX_BYTES, CACHE_LOCAL_TTL, CACHE_STORE_FACE_IMAGES,
+    DETECTION_CACHE_TTL, DETECTION_CACHE_MAX_ENTRIES, DETECTION_CACHE_MAX_BYTES,
+    GENDER_CACHE_TTL, GENDER_CACHE_MAX_ENTRIES, GENDER_CACHE_MAX_BYTES,
+    EMOTION_CACHE_TTL, EMOTION_CACHE_MAX_ENTRIES, EMOTION_CACHE_MAX_BYTES
+)
+
+redis_pool = aioredis.ConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+class LocalCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: bytes):
+        if self.max_entries <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+class TieredCache:
+    # entries are stored as binary frames, so face crops are kept as raw bytes instead of hex
+    def __init__(self, namespace: str, ttl: int, max_entries: int, max_bytes: int, local_ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LocalCache(max_entries, max_bytes, local_ttl if local_ttl is not None else ttl)
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        # after a Redis failure only the local tier is used for a while, so an outage does not add a timeout to every request
+        self.redis_skip_until = 0.0
+
+    def redis_available(self) -> bool:
+        return time.monotonic() >= self.redis_skip_until
+
+    def redis_failed(self, operation: str, error: Exception):
+        self.redis_errors += 1
+        self.redis_skip_until = time.monotonic() + REDIS_ERROR_BACKOFF
+        logger.warning(f"Redis {operation} failed for {self.namespace} cache: {str(error)}")
+
+    def redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key])).get(key)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):
+            data = self.local.get(key)
+            if data is None:
+                missing.append(key)
+            else:
+                found[key] = wire.loads(data)
+        count_cache_lookup(self.namespace, "local_hit", len(found))
+        if not missing or not self.redis_available():
+            count_cache_lookup(self.namespace, "miss", len(missing))
+            return found
+        try:
+            values = await redis_client.mget([self.redis_key(key) for key in missing])
+        except RedisError as e:
+            self.redis_failed("lookup", e)
+            count_cache_lookup(self.namespace, "miss", len(missing))
+            return found
+        for key, data in zip(missing, values):
+            if data is None:
+                self.redis_misses += 1
+                count_cache_lookup(self.namespace, "miss")
+                continue
+            self.redis_hits += 1
+            count_cache_lookup(self.namespace, "redis_hit")
+            self.local.set(key, data)
+            found[key] = wire.loads(data)
+        return found
+
+    async def set(self, key: str, value: Any):
+        await self.set_many({key: value})
+
+    async def set_many(self, items: Dict[str, Any]):
+        encoded = {key: wire.encode(value) for key, value in items.items()}
+        for key, data in encoded.items():
+            self.local.set(key, data)
+        if not encoded or not self.redis_available():
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key, data in encoded.items():
+                    pipe.setex(self.redis_key(key), self.ttl, data)
+                await pipe.execute()
+        except RedisError as e:
+            self.redis_failed("write", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local": self.local.stats(),
+            "redis": {"hits": self.redis_hits, "misses": self.redis_misses, "errors": self.redis_errors},
+        }
+
+result_cache = TieredCache("result", REDIS_TTL, CACHE_LOCAL_MAX_ENTRIES, CACHE_LOCAL_MAX_BYTES, CACHE_LOCAL_TTL)
+# stage caches: detection output is keyed by the image hash, gender and emotion results by the hash of each face crop
+detection_cache = TieredCache("detection", DETECTION_CACHE_TTL, DETECTION_CACHE_MAX_ENTRIES, DETECTION_CACHE_MAX_BYTES)
+gender_cache = TieredCache("gender", GENDER_CACHE_TTL, GENDER_CACHE_MAX_ENTRIES, GENDER_CACHE_MAX_BYTES)
+emotion_cache = TieredCache("emotion", EMOTION_CACHE_TTL, EMOTION_CACHE_MAX_ENTRIES, EMOTION_CACHE_MAX_BYTES)
 
 def generate_cache_key(image_data: bytes) -> str:
     return hashlib.md5(image_data).hexdigest()
 
-def get_cached_result(cache_key: str) -> dict | None:
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        return json.loads(cached_data)
-    return None
+async def get_cached_result(cache_key: str) -> dict | None:
+    return await result_cache.get(cache_key)
+
+async def set_cached_result(cache_key: str, result: dict):
+    if not CACHE_STORE_FACE_IMAGES:
+        result = {**result, "faces": [{k: v for k, v in face.items() if k != "face_image"} for face in result["faces"]]}
+    await result_cache.set(cache_key, result)
 
-def set_cached_result(cache_key: str, result: dict):
-    redis_client.setex(cache_key, REDIS_TTL, json.dumps(result))
\ No newline at end of file
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "result": result_cache.stats(),
+        "detection": detection_cache.stats(),
+        "gender": gender_cache.stats(),
+        "emotion": emotion_cache.stats(),
+    }
@@ -4,8 +4,92 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis-master.openfaas.svc.cluster.local")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
 REDIS_TTL = int(os.getenv("REDIS_TTL", 300))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.5))
+REDIS_ERROR_BACKOFF = float(os.getenv("REDIS_ERROR_BACKOFF", 5))
+
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", 1024))
+CACHE_LOCAL_MAX_BYTES = int(os.getenv("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", REDIS_TTL))
+CACHE_STORE_FACE_IMAGES = os.getenv("CACHE_STORE_FACE_IMAGES", "true").lower() == "true"
+# whether responses include the face crops by default, a request can override it with ?face_images=true|false
+RESPONSE_FACE_IMAGES = os.getenv("RESPONSE_FACE_IMAGES", "true").lower() == "true"
+
+STAGE_CACHE_ENABLED = os.getenv("STAGE_CACHE_ENABLED", "true").lower() == "true"
+DETECTION_CACHE_TTL = int(os.getenv("DETECTION_CACHE_TTL", REDIS_TTL))
+DETECTION_CACHE_MAX_ENTRIES = int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", 256))
+DETECTION_CACHE_MAX_BYTES = int(os.getenv("DETECTION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+GENDER_CACHE_TTL = int(os.getenv("GENDER_CACHE_TTL", 3600))
+GENDER_CACHE_MAX_ENTRIES = int(os.getenv("GENDER_CACHE_MAX_ENTRIES", 8192))
+GENDER_CACHE_MAX_BYTES = int(os.getenv("GENDER_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+EMOTION_CACHE_TTL = int(os.getenv("EMOTION_CACHE_TTL", 3600))
+EMOTION_CACHE_MAX_ENTRIES = int(os.getenv("EMOTION_CACHE_MAX_ENTRIES", 8192))
+EMOTION_CACHE_MAX_BYTES = int(os.getenv("EMOTION_CACHE_MAX_BYTES", 8 * 1024 * 1024))
 
 GATEWAY_URL = os.getenv("GATEWAY_URL", "http://gateway.openfaas:8080")
 FACE_DETECTION_FUNCTION = os.getenv("FACE_DETECTION_FUNCTION", "face-detection")
 GENDER_DETECTION_FUNCTION = os.getenv("GENDER_DETECTION_FUNCTION", "face-gender-detection")
-EMOTION_DETECTION_FUNCTION = os.getenv("EMOTION_DETECTION_FUNCTION", "face-emotion-detection")
\ No newline at end of file
+EMOTION_DETECTION_FUNCTION = os.getenv("EMOTION_DETECTION_FUNCTION", "face-emotion-detection")
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "binary")
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 200))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 100))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+FUNCTION_TIMEOUT = float(os.getenv("FUNCTION_TIMEOUT", 30))
+FUNCTION_CONNECT_TIMEOUT = float(os.getenv("FUNCTION_CONNECT_TIMEOUT", 2))
+FUNCTION_RETRIES = int(os.getenv("FUNCTION_RETRIES", 2))
+FUNCTION_RETRY_BACKOFF = float(os.getenv("FUNCTION_RETRY_BACKOFF", 0.1))
+
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 80))
+QUEUE_WAIT_TIMEOUT = float(os.getenv("QUEUE_WAIT_TIMEOUT", 1))
+FUNCTION_CONCURRENCY = int(os.getenv("FUNCTION_CONCURRENCY", 32))
+FUNCTION_CONCURRENCY_LIMITS = {
+    FACE_DETECTION_FUNCTION: int(os.getenv("FACE_DETECTION_CONCURRENCY", FUNCTION_CONCURRENCY)),
+    GENDER_DETECTION_FUNCTION: int(os.getenv("GENDER_DETECTION_CONCURRENCY", FUNCTION_CONCURRENCY)),
+    EMOTION_DETECTION_FUNCTION: int(os.getenv("EMOTION_DETECTION_CONCURRENCY", FUNCTION_CONCURRENCY)),
+}
+
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", 0))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", 95))
+
+STREAM_DETECT_INTERVAL = int(os.getenv("STREAM_DETECT_INTERVAL", 5))
+STREAM_FRAME_STRIDE = int(os.getenv("STREAM_FRAME_STRIDE", 1))
+STREAM_MAX_IN_FLIGHT = int(os.getenv("STREAM_MAX_IN_FLIGHT", 4))
+
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "distributed")
+# the same variants as the face functions' MODEL_VARIANT, produced by scripts/convert_face_models.py
+DETECTOR_MODEL_VARIANT = os.getenv("DETECTOR_MODEL_VARIANT", "fp32")
+EMOTION_MODEL_VARIANT = os.getenv("EMOTION_MODEL_VARIANT", "fp32")
+GENDER_MODEL_VARIANT = os.getenv("GENDER_MODEL_VARIANT", "caffe")
+DETECTOR_MODEL_FILES = {"fp32": "models/version-RFB-320.onnx", "fp32-dynamic": "models/version-RFB-320-dynamic.onnx",
+                        "int8": "models/version-RFB-320-int8.onnx", "rfb640": "models/version-RFB-640.onnx",
+                        "rfb640-dynamic": "models/version-RFB-640-dynamic.onnx", "rfb640-int8": "models/version-RFB-640-int8.onnx"}
+EMOTION_MODEL_FILES = {"fp32": "models/emotion-ferplus-8.onnx", "fp32-dynamic": "models/emotion-ferplus-8-dynamic.onnx",
+                       "int8": "models/emotion-ferplus-8-int8.onnx"}
+GENDER_MODEL_FILES = {"caffe": "models/gender_googlenet.caffemodel", "fp32": "models/gender_googlenet.onnx",
+                      "fp32-dynamic": "models/gender_googlenet-dynamic.onnx", "int8": "models/gender_googlenet-int8.onnx"}
+DETECTOR_MODEL_PATH = os.getenv("DETECTOR_MODEL_PATH", DETECTOR_MODEL_FILES[DETECTOR_MODEL_VARIANT])
+EMOTION_MODEL_PATH = os.getenv("EMOTION_MODEL_PATH", EMOTION_MODEL_FILES[EMOTION_MODEL_VARIANT])
+GENDER_MODEL_PATH = os.getenv("GENDER_MODEL_PATH", GENDER_MODEL_FILES[GENDER_MODEL_VARIANT])
+GENDER_CONFIG_PATH = os.getenv("GENDER_CONFIG_PATH", "models/gender_googlenet.prototxt")
+DETECTION_THRESHOLD = float(os.getenv("DETECTION_THRESHOLD", 0.8))
+# "buffer" writes float32 straight into a reused NCHW buffer, "blob" uses cv2.dnn.blobFromImages
+PREPROCESS_METHOD = os.getenv("PREPROCESS_METHOD", "buffer")
+# "single" resizes the whole image to the model input, "tiled" runs overlapping tiles, "multiscale" runs the whole
+# image and the tiles, "adaptive" picks single or ADAPTIVE_LARGE_MODE from the image size
+DETECTION_MODE = os.getenv("DETECTION_MODE", "single")
+# a tile covers TILE_SCALE times the model input in image pixels
+TILE_SCALE = float(os.getenv("TILE_SCALE", 2))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", 0.25))
+MAX_TILES = int(os.getenv("MAX_TILES", 16))
+# adaptive mode tiles images that would be shrunk by more than this factor to fit the model input
+ADAPTIVE_SCALE_THRESHOLD = float(os.getenv("ADAPTIVE_SCALE_THRESHOLD", 3))
+ADAPTIVE_LARGE_MODE = os.getenv("ADAPTIVE_LARGE_MODE", "multiscale")
+# the fused pipeline warms each model up at these batch sizes (a batch is the faces of one image) when it loads
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_BATCH_SIZES = [int(b) for b in os.getenv("WARMUP_BATCH_SIZES", "1,8").split(",") if b.strip()]
+
+NMS_IOU_THRESHOLD = float(os.getenv("NMS_IOU_THRESHOLD", 0.3))
+NMS_CANDIDATE_SIZE = int(os.getenv("NMS_CANDIDATE_SIZE", 1000))
+MAX_DETECTIONS = int(os.getenv("MAX_DETECTIONS", 200))
@@ -0,0 +1,171 @@
+import cv2
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional
+from logger import logger
+from metrics import timed
+from ort_session import BoundSession, create_session
+from registry import ModelRegistry, model_size
+from utils import clip_box, detection_windows, detector_input_size, input_buffer, merge_window_detections, nms, preprocess_detector
+from config import (
+    DETECTOR_MODEL_PATH, EMOTION_MODEL_PATH, GENDER_MODEL_PATH, GENDER_CONFIG_PATH, DETECTION_THRESHOLD, PREPROCESS_METHOD,
+    NMS_IOU_THRESHOLD, NMS_CANDIDATE_SIZE, MAX_DETECTIONS, WARMUP_ENABLED, WARMUP_BATCH_SIZES,
+    DETECTION_MODE, TILE_SCALE, TILE_OVERLAP, MAX_TILES, ADAPTIVE_SCALE_THRESHOLD, ADAPTIVE_LARGE_MODE
+)
+
+EMOTION_TABLE = {
+    0: 'neutral', 1: 'happiness', 2: 'surprise', 3: 'sadness',
+    4: 'anger', 5: 'disgust', 6: 'fear', 7: 'contempt'
+}
+GENDER_LABELS = ['Male', 'Female']
+
+# cv2.dnn.Net keeps its input as state, so concurrent requests must not interleave setInput/forward
+gender_lock = threading.Lock()
+warmup_seconds: Dict[str, float] = {}
+
+def run_session(session: BoundSession, batch: np.ndarray) -> List[np.ndarray]:
+    fixed_batch_size = session.fixed_batch_size
+    if fixed_batch_size and fixed_batch_size != len(batch):
+        # the model was exported with a static batch dimension, so feed it in slices of that size
+        outputs = [session.run(batch[i:i + fixed_batch_size]) for i in range(0, len(batch), fixed_batch_size)]
+        return [np.concatenate(output) for output in zip(*outputs)]
+    return session.run(batch)
+
+def run_gender_model(gender_model, blob: np.ndarray) -> List[np.ndarray]:
+    if isinstance(gender_model, BoundSession):
+        return run_session(gender_model, blob)
+    with gender_lock:
+        gender_model.setInput(blob)
+        return [gender_model.forward()]
+
+def warmed_up(name: str, model, run, input_shape):
+    # models are warmed up whenever they are loaded, also when an evicted model comes back
+    if WARMUP_ENABLED:
+        # a static-batch model only ever runs at its fixed batch size
+        fixed_batch_size = getattr(model, "fixed_batch_size", None)
+        batch_sizes = [fixed_batch_size] if fixed_batch_size else WARMUP_BATCH_SIZES
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            run(model, np.zeros((batch_size, *input_shape), dtype=np.float32))
+        warmup_seconds[name] = time.perf_counter() - start
+        logger.info(f"Warmed up {name} for batch sizes {batch_sizes} in {warmup_seconds[name]:.2f}s")
+    return model
+
+def load_detector():
+    detector = BoundSession(create_session(DETECTOR_MODEL_PATH))
+    width, height = detector_input_size(detector.input.shape)
+    return warmed_up("face-detection", detector, run_session, (3, height, width))
+
+def load_gender_model():
+    if GENDER_MODEL_PATH.endswith(".onnx"):
+        return BoundSession(create_session(GENDER_MODEL_PATH))
+    return cv2.dnn.readNet(GENDER_MODEL_PATH, GENDER_CONFIG_PATH)
+
+# the three models are loaded on first use and can be evicted under MODEL_MEMORY_BUDGET_MB like the text models
+registry = ModelRegistry()
+registry.register("face-detection", load_detector, model_size(DETECTOR_MODEL_PATH))
+registry.register("face-emotion-detection", lambda: warmed_up("face-emotion-detection", BoundSession(create_session(EMOTION_MODEL_PATH)), run_session, (1, 64, 64)),
+                  model_size(EMOTION_MODEL_PATH))
+registry.register("face-gender-detection", lambda: warmed_up("face-gender-detection", load_gender_model(), run_gender_model, (3, 224, 224)),
+                  model_size(GENDER_MODEL_PATH))
+
+def predict(width, height, confidences, boxes, prob_threshold, iou_threshold=NMS_IOU_THRESHOLD, top_k=MAX_DETECTIONS):
+    boxes, confidences = boxes[0], confidences[0]
+    probs = confidences[:, 1]
+    mask = probs > prob_threshold
+    if not mask.any():
+        return np.empty((0, 4), dtype=np.int32), np.empty(0)
+    box_probs = np.concatenate([boxes[mask, :], probs[mask].reshape(-1, 1)], axis=1)
+    keep = nms(box_probs[:, :4], box_probs[:, 4], iou_threshold, top_k=top_k, candidate_size=NMS_CANDIDATE_SIZE)
+    box_probs = box_probs[keep]
+    box_probs[:, :4] *= np.array([width, height, width, height])
+    return box_probs[:, :4].astype(np.int32), box_probs[:, 4]
+
+def detect_faces(image: np.ndarray):
+    detector = registry.get("face-detection")
+    input_size = detector_input_size(detector.input.shape)
+    height, width = image.shape[:2]
+    windows = detection_windows(width, height, input_size, DETECTION_MODE, TILE_SCALE, TILE_OVERLAP, MAX_TILES,
+                                ADAPTIVE_SCALE_THRESHOLD, ADAPTIVE_LARGE_MODE)
+    input_width, input_height = input_size
+    # tiles are one batch, the detector runs once per image whatever the mode
+    with input_buffer((len(windows), 3, input_height, input_width)) as buffer:
+        batch = preprocess_detector([image[y1:y2, x1:x2] for x1, y1, x2, y2 in windows], input_size, PREPROCESS_METHOD, out=buffer)
+        confidences, boxes = run_session(detector, batch)
+    if len(windows) == 1:
+        return predict(width, height, confidences, boxes, DETECTION_THRESHOLD)
+    return merge_window_detections(confidences, boxes, windows, DETECTION_THRESHOLD, NMS_IOU_THRESHOLD, top_k=MAX_DETECTIONS,
+                                   candidate_size=NMS_CANDIDATE_SIZE)
+
+def predict_genders(crops: List[np.ndarray]) -> np.ndarray:
+    blob = cv2.dnn.blobFromImages(crops, 1.0, (224, 224), (104, 117, 123), swapRB=False)
+    return run_gender_model(registry.get("face-gender-detection"), blob)[0]
+
+def predict_emotions(crops: List[np.ndarray]) -> np.ndarray:
+    batch = np.stack([cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), (64, 64)) for crop in crops])
+    scores = run_session(registry.get("face-emotion-detection"), batch[:, np.newaxis].astype(np.float32))[0]
+    exp = np.exp(scores - np.max(scores, axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def model_stats() -> Dict[str, Any]:
+    return {**registry.stats(), "warmup_seconds": dict(warmup_seconds)}
+
+def analyze_image(image_data: bytes, boxes: Optional[np.ndarray] = None, probs: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    # boxes from an earlier frame can be passed in to skip detection
+    with timed("decode"):
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        logger.error("Failed to decode image with OpenCV")
+        return {"error": "Failed to decode image"}
+
+    if boxes is None:
+        with timed("face_detection"):
+            boxes, probs = detect_faces(image)
+    height, width = image.shape[:2]
+
+    faces, crops = [], []
+    for i, box in enumerate(boxes):
+        x1, y1, x2, y2 = clip_box(box, width, height)
+        # crops stay views into the decoded image, they are only encoded if they end up in the response
+        crop = image[y1:y2, x1:x2]
+        if crop.size == 0:
+            logger.error(f"Error processing face {i+1}: empty crop for bounding box {box.tolist()}")
+            continue
+        faces.append({
+            "face_id": len(faces) + 1,
+            "confidence": float(probs[i]),
+            "bounding_box": [x1, y1, x2, y2],
+            "face_image": crop
+        })
+        crops.append(crop)
+
+    gender_results, emotion_results = [], []
+    if crops:
+        with timed("gender_detection"):
+            gender_outputs = predict_genders(crops)
+        with timed("emotion_detection"):
+            emotion_probabilities = predict_emotions(crops)
+        for face, gender_output, probabilities in zip(faces, gender_outputs, emotion_probabilities):
+            gender_index = gender_output.argmax()
+            emotion_index = probabilities.argmax()
+            gender_results.append({
+                "face_id": face["face_id"],
+                "gender_result": {"predicted_gender": GENDER_LABELS[gender_index], "gender_confidence": float(gender_output[gender_index])},
+                "face_detection_confidence": face["confidence"]
+            })
+            emotion_results.append({
+                "face_id": face["face_id"],
+                "emotion_result": {
+                    "predicted_emotion": EMOTION_TABLE[emotion_index],
+                    "emotion_confidence": float(probabilities[emotion_index]),
+                    "emotion_probabilities": {EMOTION_TABLE[i]: float(prob) for i, prob in enumerate(probabilities)}
+                },
+                "face_detection_confidence": face["confidence"]
+            })
+
+    return {
+        "face_detection": {"num_faces_detected": len(faces), "faces": faces},
+        "gender_detection": {"num_faces_processed": len(gender_results), "gender_results": gender_results},
+        "emotion_detection": {"num_faces_processed": len(emotion_results), "emotion_results": emotion_results}
+    }
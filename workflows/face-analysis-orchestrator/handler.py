@@ -1,33 +1,76 @@
 import json
+import os
 import sys
 import asyncio
+from urllib.parse import parse_qsl
+import wire
 from logger import logger
-from workflow import face_analysis_workflow
+from server import SERVER_MODE, request_query, serve
+from workflow import face_analysis_workflow, close_client_session
+from cache import cache_stats
+from config import PIPELINE_MODE, RESPONSE_FACE_IMAGES
+from limits import RequestRejected, limits_stats, set_deadline
+from metrics import finish_trace, start_trace, timed
+from video import stream_analysis
 
 async def handle_async(req: bytes) -> bytes:
     try:
         if not req:
             return json.dumps({"error": "Empty request"}).encode('utf-8')
         
-        result = await face_analysis_workflow(req)
+        face_images = request_query.get().get("face_images", str(RESPONSE_FACE_IMAGES)).lower() == "true"
+        result = await face_analysis_workflow(req, face_images)
         
-        return json.dumps(result).encode('utf-8')
+        # face crops stay raw bytes inside the workflow and are hex-encoded only for the JSON response
+        with timed("serialize"):
+            return wire.to_json(result)
     
+    except RequestRejected:
+        # shed or timed-out requests are answered with a status code by the server
+        raise
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         return json.dumps({"error": f"An unexpected error occurred: {str(e)}"}).encode('utf-8')
 
+def stats() -> dict:
+    result = {"cache": cache_stats(), "limits": limits_stats()}
+    if PIPELINE_MODE == "fused":
+        from fused import model_stats
+        result["models"] = model_stats()
+    return result
+
+# a single loop for synchronous callers, so the pooled gateway and Redis connections outlive a request
+loop = asyncio.new_event_loop()
+
 def handle(req: bytes) -> bytes:
-    return asyncio.run(handle_async(req))
+    # in streaming mode the watchdog passes request headers as Http_* environment variables
+    set_deadline(os.getenv("Http_X_Request_Timeout"))
+    request_query.set(dict(parse_qsl(os.getenv("Http_Query", ""))))
+    trace = start_trace(os.getenv("Http_Traceparent"))
+    try:
+        return loop.run_until_complete(handle_async(req))
+    except RequestRejected as e:
+        return json.dumps({"error": str(e)}).encode('utf-8')
+    finally:
+        finish_trace(trace)
 
 if __name__ == "__main__":
-    try:
-        input_data = sys.stdin.buffer.read()
-        ret = handle(input_data)
-        sys.stdout.buffer.write(ret)
-        sys.stdout.buffer.flush()
-    except Exception as e:
-        logger.error(f"Error in main execution: {str(e)}", exc_info=True)
-        error_response = json.dumps({"error": f"Main execution failed: {str(e)}"}).encode('utf-8')
-        sys.stdout.buffer.write(error_response)
-        sys.stdout.buffer.flush()
\ No newline at end of file
+    if SERVER_MODE == "http":
+        if PIPELINE_MODE == "fused":
+            # the fused models are loaded and warmed up before the function reports ready
+            from fused import registry
+            registry.preload(registry.names())
+        serve(handle_async, stats=stats, cleanup=close_client_session,
+              stream=stream_analysis)
+    else:
+        try:
+            input_data = sys.stdin.buffer.read()
+            ret = handle(input_data)
+            sys.stdout.buffer.write(ret)
+            sys.stdout.buffer.flush()
+            loop.run_until_complete(close_client_session())
+        except Exception as e:
+            logger.error(f"Error in main execution: {str(e)}", exc_info=True)
+            error_response = json.dumps({"error": f"Main execution failed: {str(e)}"}).encode('utf-8')
+            sys.stdout.buffer.write(error_response)
+            sys.stdout.buffer.flush()
\ No newline at end of file
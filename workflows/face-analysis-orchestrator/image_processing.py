@@ -1,27 +1,162 @@
 import cv2
+import struct
 import numpy as np
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from logger import logger
+from config import MAX_IMAGE_SIDE, JPEG_QUALITY
+from utils import clip_box
+
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# start-of-frame markers carry the frame dimensions (DHT, JPG and DAC share the range but do not)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+JPEG_APP1_MARKER = 0xE1
+EXIF_SIGNATURE = b"Exif\x00\x00"
+EXIF_ORIENTATION_TAG = 0x0112
+# EXIF orientations 5-8 rotate by 90 degrees, cv2.imdecode applies them, so the decoded image has width and height swapped
+EXIF_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+def read_exif_orientation(segment: bytes) -> int:
+    # segment is an APP1 payload: "Exif\0\0", then a TIFF header and IFD0, which holds the orientation tag
+    if not segment.startswith(EXIF_SIGNATURE):
+        return 1
+    tiff = segment[len(EXIF_SIGNATURE):]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return 1
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    entries = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for entry in range(entries):
+        start = ifd_offset + 2 + entry * 12
+        if start + 12 > len(tiff):
+            break
+        tag, _, _ = struct.unpack(endian + "HHI", tiff[start:start + 8])
+        if tag == EXIF_ORIENTATION_TAG:
+            return struct.unpack(endian + "H", tiff[start + 8:start + 10])[0]
+    return 1
+
+def read_jpeg_size(image_data: bytes) -> Optional[Tuple[int, int]]:
+    offset = 2
+    orientation = 1
+    while offset + 4 <= len(image_data):
+        if image_data[offset] != 0xFF:
+            return None
+        marker = image_data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            return None
+        segment_length = struct.unpack(">H", image_data[offset + 2:offset + 4])[0]
+        if marker == JPEG_APP1_MARKER and orientation == 1:
+            orientation = read_exif_orientation(image_data[offset + 4:offset + 2 + segment_length])
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(image_data):
+                return None
+            height, width = struct.unpack(">HH", image_data[offset + 5:offset + 9])
+            # the size is reported as the decoder returns the image, after the EXIF rotation
+            return (height, width) if orientation in EXIF_TRANSPOSED_ORIENTATIONS else (width, height)
+        offset += 2 + segment_length
+    return None
+
+def read_image_size(image_data: bytes) -> Optional[Tuple[int, int]]:
+    if image_data.startswith(JPEG_SIGNATURE):
+        return read_jpeg_size(image_data)
+    if image_data.startswith(PNG_SIGNATURE) and len(image_data) >= 24 and image_data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", image_data[16:24])
+        return width, height
+    return None
+
+def reduced_read_flag(longest_side: int) -> int:
+    # let the decoder downsample by 2/4/8 while the result still covers MAX_IMAGE_SIDE
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if longest_side // factor >= MAX_IMAGE_SIDE:
+            return flag
+    return cv2.IMREAD_COLOR
+
+def encode_downscaled(image: np.ndarray, original_longest_side: int) -> Dict[str, Any]:
+    ratio = MAX_IMAGE_SIDE / max(image.shape[:2])
+    if ratio < 1:
+        image = cv2.resize(image, (round(image.shape[1] * ratio), round(image.shape[0] * ratio)), interpolation=cv2.INTER_AREA)
+    _, encoded_image = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    logger.info(f"Downscaled image with longest side {original_longest_side} to {image.shape[1]}x{image.shape[0]}")
+
+    return {
+        "image": encoded_image.tobytes(),
+        "image_shape": image.shape,
+        "scale": original_longest_side / max(image.shape[:2])
+    }
+
+def downscale_image(image_data: bytes, width: int, height: int) -> Dict[str, Any]:
+    longest_side = max(width, height)
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), reduced_read_flag(longest_side))
+    if image is None:
+        logger.error("Failed to decode image with OpenCV")
+        return {"error": "Failed to decode image"}
+    return encode_downscaled(image, longest_side)
+
+def crop_faces(image_data: bytes, faces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # cuts known boxes out of a new frame, in the same shape the face-detection function answers with
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        logger.error("Failed to decode image with OpenCV")
+        return {"error": "Failed to decode image"}
+
+    height, width = image.shape[:2]
+    cropped_faces = []
+    for face in faces:
+        x1, y1, x2, y2 = clip_box(face["bounding_box"], width, height)
+        crop = image[y1:y2, x1:x2]
+        if crop.size == 0:
+            continue
+        cropped_faces.append({
+            "face_id": len(cropped_faces) + 1,
+            "confidence": face["detection_confidence"],
+            "bounding_box": [x1, y1, x2, y2],
+            "face_image": cv2.imencode('.jpg', crop)[1].tobytes()
+        })
+    return {"num_faces_detected": len(cropped_faces), "faces": cropped_faces}
 
 def process_image(image_data: bytes) -> Dict[str, Any]:
     if not image_data:
         return {"error": "Empty image data"}
 
     try:
+        size = read_image_size(image_data)
+        if size is not None:
+            width, height = size
+            if width == 0 or height == 0:
+                return {"error": "Invalid image dimensions"}
+            if MAX_IMAGE_SIDE and max(width, height) > MAX_IMAGE_SIDE:
+                return downscale_image(image_data, width, height)
+            # JPEG and PNG are forwarded untouched, the detector decodes them itself
+            return {
+                "image": image_data,
+                "image_shape": (height, width, 3)
+            }
+
         nparr = np.frombuffer(image_data, np.uint8)
-        
+
         original_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         if original_image is None:
             logger.error("Failed to decode image with OpenCV")
             return {"error": "Failed to decode image"}
-        
+
+        if MAX_IMAGE_SIDE and max(original_image.shape[:2]) > MAX_IMAGE_SIDE:
+            return encode_downscaled(original_image, max(original_image.shape[:2]))
+
         _, encoded_image = cv2.imencode('.jpg', original_image)
-        image_base64 = encoded_image.tobytes().hex()
-        
+
         return {
-            "image": image_base64,
+            "image": encoded_image.tobytes(),
             "image_shape": original_image.shape
         }
     except Exception as e:
         logger.error(f"Error in process_image: {str(e)}")
-        return {"error": f"Image processing failed: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Image processing failed: {str(e)}"}
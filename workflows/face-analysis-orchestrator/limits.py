@@ -0,0 +1,106 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from logger import logger
+from config import FUNCTION_CONCURRENCY, FUNCTION_CONCURRENCY_LIMITS, QUEUE_WAIT_TIMEOUT, REQUEST_TIMEOUT
+
+# relative budget in seconds, read from callers and forwarded to every downstream call
+DEADLINE_HEADER = "X-Request-Timeout"
+
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class RequestRejected(Exception):
+    status = 503
+
+class Overloaded(RequestRejected):
+    status = 429
+
+class DeadlineExceeded(RequestRejected):
+    status = 504
+
+def give_back(semaphore: asyncio.Semaphore, acquiring: asyncio.Task):
+    # a pending acquire is cancelled, one that already got the permit releases it
+    if not acquiring.done():
+        acquiring.cancel()
+    elif not acquiring.cancelled():
+        semaphore.release()
+
+async def acquire(semaphore: asyncio.Semaphore, timeout: float):
+    # before Python 3.12, wait_for can drop a permit granted just as it times out or its caller is cancelled,
+    # so the acquire runs as its own task and a permit it got anyway is handed back
+    acquiring = asyncio.ensure_future(semaphore.acquire())
+    try:
+        done, _ = await asyncio.wait([acquiring], timeout=timeout)
+    except asyncio.CancelledError:
+        give_back(semaphore, acquiring)
+        raise
+    if not done:
+        give_back(semaphore, acquiring)
+        raise asyncio.TimeoutError()
+
+class FunctionLimiter:
+    def __init__(self, function_name: str, limit: int):
+        self.function_name = function_name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        wait = QUEUE_WAIT_TIMEOUT
+        remaining = remaining_time()
+        if remaining is not None:
+            # an expired request is not an overload, the caller gets a 504 rather than a 429 to retry
+            if remaining <= 0:
+                raise DeadlineExceeded("Request deadline exceeded")
+            wait = min(wait, remaining)
+        self.waiting += 1
+        try:
+            await acquire(self.semaphore, wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            if remaining is not None and wait >= remaining:
+                logger.warning(f"Shedding call to {self.function_name}: deadline passed while waiting for a slot")
+                raise DeadlineExceeded("Request deadline exceeded")
+            logger.warning(f"Shedding call to {self.function_name}: no free slot after {wait:.2f}s ({self.limit} in flight)")
+            raise Overloaded(f"{self.function_name} is overloaded, try again later")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting, "rejected": self.rejected}
+
+limiters: Dict[str, FunctionLimiter] = {}
+
+def get_limiter(function_name: str) -> FunctionLimiter:
+    if function_name not in limiters:
+        limiters[function_name] = FunctionLimiter(function_name, FUNCTION_CONCURRENCY_LIMITS.get(function_name, FUNCTION_CONCURRENCY))
+    return limiters[function_name]
+
+def set_deadline(timeout: Optional[str] = None) -> float:
+    budget = REQUEST_TIMEOUT
+    if timeout:
+        try:
+            budget = min(budget, float(timeout))
+        except ValueError:
+            logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {timeout}")
+    request_deadline.set(time.monotonic() + budget)
+    return budget
+
+def remaining_time() -> Optional[float]:
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def limits_stats() -> Dict[str, Any]:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,102 @@
+import logging
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.exposition import choose_encoder
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "/metrics"
+# W3C trace context, forwarded by the orchestrator on every gateway call
+TRACEPARENT_HEADER = "traceparent"
+SERVER_TIMING_HEADER = "Server-Timing"
+# requests slower than this log their per-stage breakdown with the trace id; 0 disables the log
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram("faas_request_duration_seconds", "Time to handle a request", buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("faas_stage_duration_seconds", "Time spent in each stage of a request", ["stage"], buckets=LATENCY_BUCKETS)
+DOWNSTREAM_SECONDS = Histogram("faas_downstream_duration_seconds", "Time of each gateway call, retries included",
+                               ["function", "outcome"], buckets=LATENCY_BUCKETS)
+FACES_PER_REQUEST = Histogram("faas_faces_per_request", "Faces detected or processed per request",
+                              buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128))
+BATCH_SIZE = Histogram("faas_batch_size", "Items per micro-batch", ["batcher"], buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+CACHE_LOOKUPS = Counter("faas_cache_lookups_total", "Cache lookups by outcome", ["cache", "result"])
+
+class Trace:
+    def __init__(self, traceparent: Optional[str] = None):
+        parts = (traceparent or "").strip().split("-")
+        valid = len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16 and parts[1] != "0" * 32
+        # a request without a valid traceparent starts a new trace
+        self.trace_id = parts[1] if valid else secrets.token_hex(16)
+        self.flags = parts[3] if valid else "01"
+        self.span_id = secrets.token_hex(8)
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def traceparent(self) -> str:
+        # downstream calls are children of this request's span
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags}"
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items())
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+def start_trace(traceparent: Optional[str] = None) -> Trace:
+    trace = Trace(traceparent)
+    _trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+def exemplar(trace: Optional[Trace]) -> Optional[Dict[str, str]]:
+    return {"trace_id": trace.trace_id} if trace is not None else None
+
+def observe_stage(stage: str, seconds: float):
+    # the stage also counts towards the current request's breakdown, stages outside a request only reach the histogram
+    trace = _trace.get()
+    if trace is not None:
+        trace.record(stage, seconds)
+    STAGE_SECONDS.labels(stage).observe(seconds, exemplar(trace))
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def observe_downstream(function_name: str, outcome: str, seconds: float):
+    trace = _trace.get()
+    if trace is not None:
+        trace.record(f"call_{function_name}", seconds)
+    DOWNSTREAM_SECONDS.labels(function_name, outcome).observe(seconds, exemplar(trace))
+
+def count_cache_lookup(cache: str, result: str, count: int = 1):
+    if count:
+        CACHE_LOOKUPS.labels(cache, result).inc(count)
+
+def finish_trace(trace: Trace) -> float:
+    seconds = time.perf_counter() - trace.start
+    REQUEST_SECONDS.observe(seconds, exemplar(trace))
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ", ".join(f"{stage}={stage_seconds * 1000:.1f}ms" for stage, stage_seconds in trace.stages.items())
+        logger.warning(f"Slow request {trace.trace_id}: {seconds * 1000:.1f}ms ({breakdown})")
+    return seconds
+
+def render(accept: Optional[str]) -> Tuple[bytes, str]:
+    # exemplars carrying trace ids are only part of the OpenMetrics format, plain scrapes get the text format
+    encoder, content_type = choose_encoder(accept or "")
+    return encoder(REGISTRY), content_type
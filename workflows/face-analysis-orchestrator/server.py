@@ -0,0 +1,100 @@
+import asyncio
+import os
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+from urllib.parse import urlparse
+
+from aiohttp import web
+from logger import logger
+from limits import DEADLINE_HEADER, DeadlineExceeded, RequestRejected, set_deadline
+from metrics import METRICS_PATH, SERVER_TIMING_HEADER, TRACEPARENT_HEADER, finish_trace, render, start_trace, timed
+
+SERVER_MODE = os.getenv("mode", "streaming")
+SERVER_PORT = urlparse(os.getenv("upstream_url", "http://127.0.0.1:5000")).port or 5000
+HEALTH_PATH = "/_/health"
+STATS_PATH = "/_/stats"
+STREAM_PATH = "/stream"
+# with suppress_lock the watchdog leaves the lock file, and so the readiness probe, to the function
+LOCK_FILE = os.getenv("LOCK_FILE", "/tmp/.lock")
+
+# query parameters of the request being handled, so handlers that only receive the body can read options
+request_query: ContextVar[Mapping[str, str]] = ContextVar("request_query", default={})
+
+AsyncHandler = Callable[[bytes], Awaitable[bytes]]
+StatsProvider = Callable[[], Dict[str, Any]]
+Cleanup = Callable[[], Awaitable[None]]
+StreamHandler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+def mark_ready(ready: bool = True):
+    if ready:
+        with open(LOCK_FILE, "w"):
+            pass
+        logger.info(f"Ready, wrote {LOCK_FILE}")
+    elif os.path.exists(LOCK_FILE):
+        os.remove(LOCK_FILE)
+
+def create_app(handle_async: AsyncHandler, stats: Optional[StatsProvider] = None, cleanup: Optional[Cleanup] = None,
+               stream: Optional[StreamHandler] = None) -> web.Application:
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    async def stats_handler(request: web.Request) -> web.Response:
+        return web.json_response(stats() if stats else {})
+
+    async def metrics_handler(request: web.Request) -> web.Response:
+        body, content_type = render(request.headers.get("Accept"))
+        return web.Response(body=body, headers={"Content-Type": content_type})
+
+    async def invoke(request: web.Request) -> web.Response:
+        # the trace id reaches every gateway call made for this request through the traceparent header
+        trace = start_trace(request.headers.get(TRACEPARENT_HEADER))
+        with timed("receive"):
+            body = await request.read()
+        request_query.set(request.query)
+        budget = set_deadline(request.headers.get(DEADLINE_HEADER))
+        try:
+            result = await asyncio.wait_for(handle_async(body), budget)
+        except asyncio.TimeoutError:
+            return rejected(DeadlineExceeded("Request deadline exceeded"))
+        except RequestRejected as e:
+            return rejected(e)
+        finally:
+            finish_trace(trace)
+        return web.Response(body=result, content_type="application/json",
+                            headers={SERVER_TIMING_HEADER: trace.server_timing()} if trace.stages else None)
+
+    async def traced_stream(request: web.Request) -> web.StreamResponse:
+        # a stream runs for as long as the client sends frames, so it carries a trace id but is not timed as one request
+        start_trace(request.headers.get(TRACEPARENT_HEADER))
+        return await stream(request)
+
+    def rejected(error: RequestRejected) -> web.Response:
+        headers = {"Retry-After": "1"} if error.status == 429 else None
+        return web.json_response({"error": str(error)}, status=error.status, headers=headers)
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_get(HEALTH_PATH, health)
+    app.router.add_get(STATS_PATH, stats_handler)
+    app.router.add_get(METRICS_PATH, metrics_handler)
+    if stream:
+        app.router.add_post(STREAM_PATH, traced_stream)
+    app.router.add_route("*", "/{tail:.*}", invoke)
+    if cleanup:
+        app.on_cleanup.append(lambda app: cleanup())
+    return app
+
+async def on_startup(app: web.Application):
+    # anything that has to be loaded or warmed up runs before serve is called
+    mark_ready()
+
+async def on_shutdown(app: web.Application):
+    mark_ready(False)
+
+def serve(handle_async: AsyncHandler, port: int = SERVER_PORT, stats: Optional[StatsProvider] = None, cleanup: Optional[Cleanup] = None,
+          stream: Optional[StreamHandler] = None):
+    logger.info(f"Serving requests on port {port}")
+    app = create_app(handle_async, stats, cleanup, stream)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    web.run_app(app, host="0.0.0.0", port=port, access_log=None, print=None,
+               handler_cancellation=True)
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiohttp import web
+
+import wire
+from logger import logger
+from workflow import analyze_image_data, analyze_known_faces
+from config import STREAM_DETECT_INTERVAL, STREAM_FRAME_STRIDE, STREAM_MAX_IN_FLIGHT
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+async def read_frames(request: web.Request) -> AsyncIterator[bytes]:
+    # multipart bodies (MJPEG / multipart/x-mixed-replace) are consumed part by part as they arrive,
+    # anything else is a single frame-list message: {"frames": [...]} as JSON or a binary frame
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        async for part in reader:
+            yield await part.read()
+        return
+
+    body = await request.read()
+    message = wire.decode(body) if wire.is_frame(body) else json.loads(body.decode('utf-8'))
+    for frame in message.get("frames", []):
+        yield frame if isinstance(frame, bytes) else bytes.fromhex(frame)
+
+async def analyze_frame(frame: bytes, keyframe: Optional[asyncio.Task], face_images: bool = False) -> Dict[str, Any]:
+    try:
+        if keyframe is not None:
+            seed = await asyncio.shield(keyframe)
+            if "error" not in seed:
+                return await analyze_known_faces(frame, seed["faces"], face_images)
+        return await analyze_image_data(frame, face_images)
+    except Exception as e:
+        logger.error(f"Error analyzing frame: {str(e)}", exc_info=True)
+        return {"error": f"Frame analysis failed: {str(e)}"}
+
+def query_int(request: web.Request, name: str, default: int) -> int:
+    try:
+        return max(1, int(request.query.get(name, default)))
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"Invalid {name}"}), content_type="application/json")
+
+async def stream_analysis(request: web.Request) -> web.StreamResponse:
+    detect_every = query_int(request, "detect_every", STREAM_DETECT_INTERVAL)
+    frame_stride = query_int(request, "frame_stride", STREAM_FRAME_STRIDE)
+    face_images = request.query.get("face_images", "false").lower() == "true"
+
+    response = web.StreamResponse(headers={"Content-Type": NDJSON_CONTENT_TYPE})
+    await response.prepare(request)
+
+    async def write_result(frame_index: int, detected: bool, task: asyncio.Task):
+        result = await task
+        await response.write(wire.to_json({"frame": frame_index, "detected": detected, **result}) + b"\n")
+
+    # frames are analysed concurrently but written in arrival order; a full detection runs every
+    # detect_every frames and the frames in between reuse its boxes
+    in_flight = deque()
+    keyframe = None
+    analyzed = 0
+    try:
+        frame_index = -1
+        async for frame in read_frames(request):
+            frame_index += 1
+            if frame_index % frame_stride:
+                continue
+            detected = analyzed % detect_every == 0
+            task = asyncio.create_task(analyze_frame(frame, None if detected else keyframe, face_images))
+            if detected:
+                keyframe = task
+            in_flight.append((frame_index, detected, task))
+            analyzed += 1
+            while len(in_flight) >= STREAM_MAX_IN_FLIGHT:
+                await write_result(*in_flight.popleft())
+        while in_flight:
+            await write_result(*in_flight.popleft())
+    except ValueError as e:
+        logger.error(f"Invalid frame stream: {str(e)}")
+        await response.write(wire.to_json({"error": f"Invalid frame stream: {str(e)}"}) + b"\n")
+    finally:
+        for _, _, task in in_flight:
+            task.cancel()
+
+    logger.info(f"Streamed results for {analyzed} of {frame_index + 1} frames")
+    await response.write_eof()
+    return response
@@ -1,75 +1,303 @@
 import asyncio
 import aiohttp
+import contextvars
+import cv2
 import json
-from typing import Dict, Any
+import numpy as np
+import random
+import time
+import wire
+from typing import Any, Dict, List, Optional
 from logger import logger
-from cache import generate_cache_key, get_cached_result, set_cached_result
-from image_processing import process_image
-from config import FACE_DETECTION_FUNCTION, GENDER_DETECTION_FUNCTION, EMOTION_DETECTION_FUNCTION, GATEWAY_URL
+from cache import generate_cache_key, get_cached_result, set_cached_result, detection_cache, gender_cache, emotion_cache, TieredCache
+from image_processing import crop_faces, process_image
+from limits import DEADLINE_HEADER, DeadlineExceeded, get_limiter, remaining_time
+from metrics import FACES_PER_REQUEST, TRACEPARENT_HEADER, current_trace, observe_downstream, timed
+from config import (
+    FACE_DETECTION_FUNCTION, GENDER_DETECTION_FUNCTION, EMOTION_DETECTION_FUNCTION, GATEWAY_URL, WIRE_FORMAT, PIPELINE_MODE, STAGE_CACHE_ENABLED,
+    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL,
+    FUNCTION_TIMEOUT, FUNCTION_CONNECT_TIMEOUT, FUNCTION_RETRIES, FUNCTION_RETRY_BACKOFF, CACHE_STORE_FACE_IMAGES
+)
+
+# gateway responses worth retrying: the function is scaling up, restarting or briefly overloaded
+RETRY_STATUSES = {429, 502, 503, 504}
+
+client_session: Optional[aiohttp.ClientSession] = None
+client_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_client_session() -> aiohttp.ClientSession:
+    # one pooled session per event loop, so keep-alive connections to the gateway are reused across requests
+    global client_session, client_session_loop
+    loop = asyncio.get_running_loop()
+    if client_session is None or client_session.closed or client_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, ttl_dns_cache=HTTP_DNS_CACHE_TTL
+        )
+        client_session = aiohttp.ClientSession(connector=connector)
+        client_session_loop = loop
+    return client_session
+
+async def close_client_session():
+    global client_session
+    if client_session is not None and not client_session.closed:
+        await client_session.close()
+    client_session = None
+
+async def post_function(session: aiohttp.ClientSession, url: str, body: bytes, headers: Dict[str, str]) -> Dict[str, Any]:
+    # the call never outlives the caller's deadline, which is also forwarded so downstream can drop stale work
+    total = FUNCTION_TIMEOUT
+    remaining = remaining_time()
+    if remaining is not None:
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        total = min(total, remaining)
+        headers = {**headers, DEADLINE_HEADER: f"{remaining:.3f}"}
+    timeout = aiohttp.ClientTimeout(total=total, sock_connect=FUNCTION_CONNECT_TIMEOUT)
+    try:
+        async with session.post(url, data=body, headers=headers, timeout=timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            payload = await response.read()
+    except asyncio.TimeoutError as e:
+        if total < FUNCTION_TIMEOUT and not isinstance(e, aiohttp.ServerTimeoutError):
+            raise DeadlineExceeded("Request deadline exceeded") from e
+        raise
+    
+    # functions running in streaming mode cannot set the content type, so also sniff the frame header
+    with timed("deserialize"):
+        if wire.CONTENT_TYPE in content_type or wire.is_frame(payload):
+            return wire.decode(payload)
+        elif 'application/json' in content_type or 'application/octet-stream' in content_type:
+            return json.loads(payload.decode('utf-8'))
+        else:
+            raise ValueError(f"Unexpected content type: {content_type}")
 
 async def call_function_async(session: aiohttp.ClientSession, function_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
     url = f"{GATEWAY_URL}/function/{function_name}"
-    headers = {'Content-Type': 'application/json'}
-    
-    async with session.post(url, json=data, headers=headers) as response:
-        response.raise_for_status()
-        content_type = response.headers.get('Content-Type', '')
-        
-        if 'application/json' in content_type:
-            return await response.json()
-        elif 'application/octet-stream' in content_type:
-            binary_data = await response.read()
-            return json.loads(binary_data.decode('utf-8'))
+    
+    with timed("serialize"):
+        if WIRE_FORMAT == "binary":
+            body = wire.encode(data)
+            headers = {'Content-Type': wire.CONTENT_TYPE, 'Accept': f"{wire.CONTENT_TYPE}, {wire.JSON_CONTENT_TYPE}"}
         else:
-            raise ValueError(f"Unexpected content type: {content_type}")
+            body = wire.to_json(data)
+            headers = {'Content-Type': wire.JSON_CONTENT_TYPE, 'Accept': wire.JSON_CONTENT_TYPE}
+    
+    trace = current_trace()
+    if trace is not None:
+        headers[TRACEPARENT_HEADER] = trace.traceparent()
+    
+    limiter = get_limiter(function_name)
+    # retries and backoff count towards the call, it is the time the stage waited for the function
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        for attempt in range(FUNCTION_RETRIES + 1):
+            try:
+                async with limiter.slot():
+                    result = await post_function(session, url, body, headers)
+                outcome = "ok"
+                return result
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError) as e:
+                retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUSES
+                if not retryable or attempt == FUNCTION_RETRIES:
+                    raise
+                delay = FUNCTION_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    raise
+                logger.warning(f"Call to {function_name} failed ({str(e)}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+    finally:
+        observe_downstream(function_name, outcome, time.perf_counter() - start)
 
-async def face_analysis_workflow(image_data: bytes) -> Dict[str, Any]:
-    logger.info(f"face_analysis_workflow received data of length: {len(image_data)} bytes")
+def scale_box(box: list, scale: float) -> list:
+    # boxes from a downscaled upload are mapped back onto the original image
+    return box if scale == 1 else [round(value * scale) for value in box]
+
+def encode_face_image(face_image: Any) -> bytes:
+    # the fused pipeline hands over crops as arrays, they are only encoded for the response
+    if isinstance(face_image, np.ndarray):
+        return cv2.imencode('.jpg', face_image)[1].tobytes()
+    return face_image if isinstance(face_image, bytes) else bytes.fromhex(face_image)
+
+async def run_detection_stage(session: aiohttp.ClientSession, processed_image: Dict[str, Any]) -> Dict[str, Any]:
+    cache_key = generate_cache_key(processed_image["image"]) if STAGE_CACHE_ENABLED else None
+    if cache_key:
+        with timed("cache_lookup"):
+            cached_result = await detection_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("Using cached face detection result")
+            return cached_result
     
-    cache_key = generate_cache_key(image_data)
-    cached_result = get_cached_result(cache_key)
-    if cached_result:
-        logger.info("Returning cached result")
-        return cached_result
+    face_detection_result = await call_function_async(session, FACE_DETECTION_FUNCTION, processed_image)
+    if cache_key and "error" not in face_detection_result:
+        await detection_cache.set(cache_key, face_detection_result)
+    return face_detection_result
+
+async def run_attribute_stage(session: aiohttp.ClientSession, function_name: str, stage: str, stage_cache: TieredCache, faces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # only faces whose crop has not been seen before are sent to the function
+    with timed("cache_lookup"):
+        crop_keys = {face["face_id"]: generate_cache_key(encode_face_image(face["face_image"])) for face in faces}
+        stage_results = await stage_cache.get_many(list(crop_keys.values())) if STAGE_CACHE_ENABLED else {}
+    pending = [face for face in faces if crop_keys[face["face_id"]] not in stage_results]
+    if len(pending) < len(faces):
+        logger.info(f"Using cached {stage} results for {len(faces) - len(pending)} of {len(faces)} faces")
     
-    processed_image = process_image(image_data)
-    if "error" in processed_image:
-        return processed_image
+    if pending:
+        result = await call_function_async(session, function_name, {"faces": pending})
+        if "error" in result:
+            return result
+        fresh_results = {crop_keys[item["face_id"]]: item[f"{stage}_result"] for item in result[f"{stage}_results"]}
+        if STAGE_CACHE_ENABLED:
+            await stage_cache.set_many(fresh_results)
+        stage_results.update(fresh_results)
+    
+    results = [
+        {"face_id": face["face_id"], f"{stage}_result": stage_results[crop_keys[face["face_id"]]], "face_detection_confidence": face["confidence"]}
+        for face in faces if crop_keys[face["face_id"]] in stage_results
+    ]
+    return {"num_faces_processed": len(results), f"{stage}_results": results}
+
+async def run_attribute_stages(session: aiohttp.ClientSession, face_detection_result: Dict[str, Any]) -> Dict[str, Any]:
+    faces = face_detection_result["faces"]
+    gender_task = asyncio.create_task(run_attribute_stage(session, GENDER_DETECTION_FUNCTION, "gender", gender_cache, faces))
+    emotion_task = asyncio.create_task(run_attribute_stage(session, EMOTION_DETECTION_FUNCTION, "emotion", emotion_cache, faces))
+    
+    try:
+        gender_detection_result, emotion_detection_result = await asyncio.gather(gender_task, emotion_task)
+    except Exception:
+        # a shed or failed stage fails the request, so the other stage stops holding its slot and the gateway
+        for task in (gender_task, emotion_task):
+            task.cancel()
+        raise
 
-    async with aiohttp.ClientSession() as session:
-        face_detection_result = await call_function_async(session, FACE_DETECTION_FUNCTION, processed_image)
-        
+    return {
+        "face_detection": face_detection_result,
+        "gender_detection": gender_detection_result,
+        "emotion_detection": emotion_detection_result
+    }
+
+async def run_distributed(processed_image: Dict[str, Any]) -> Dict[str, Any]:
+    session = get_client_session()
+    face_detection_result = await run_detection_stage(session, processed_image)
+    
+    if "error" in face_detection_result:
+        logger.error(f"Error from face-detection function: {face_detection_result['error']}")
+        return face_detection_result
+    
+    logger.info(f"Face detection successful. Detected {face_detection_result['num_faces_detected']} faces.")
+    
+    return await run_attribute_stages(session, face_detection_result)
+
+async def run_fused(processed_image: Dict[str, Any]) -> Dict[str, Any]:
+    from fused import analyze_image
+    # the executor runs a copy of the request's context, so the fused stages count towards its trace
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, analyze_image, processed_image["image"])
+
+async def analyze_known_faces(image_data: bytes, faces: List[Dict[str, Any]], face_images: bool = True) -> Dict[str, Any]:
+    # re-runs gender and emotion on boxes found in an earlier frame, without calling face-detection
+    loop = asyncio.get_running_loop()
+    if PIPELINE_MODE == "fused":
+        from fused import analyze_image
+        boxes = np.array([face["bounding_box"] for face in faces], dtype=np.int32).reshape(-1, 4)
+        probs = np.array([face["detection_confidence"] for face in faces])
+        stage_results = await loop.run_in_executor(None, contextvars.copy_context().run, analyze_image, image_data, boxes, probs)
+    else:
+        face_detection_result = await loop.run_in_executor(None, contextvars.copy_context().run, crop_faces, image_data, faces)
         if "error" in face_detection_result:
-            logger.error(f"Error from face-detection function: {face_detection_result['error']}")
             return face_detection_result
-        
-        logger.info(f"Face detection successful. Detected {face_detection_result['num_faces_detected']} faces.")
-        
-        gender_task = asyncio.create_task(call_function_async(session, GENDER_DETECTION_FUNCTION, face_detection_result))
-        emotion_task = asyncio.create_task(call_function_async(session, EMOTION_DETECTION_FUNCTION, face_detection_result))
-        
-        gender_detection_result, emotion_detection_result = await asyncio.gather(gender_task, emotion_task)
+        stage_results = await run_attribute_stages(get_client_session(), face_detection_result)
+    if "error" in stage_results:
+        return stage_results
+    with timed("postprocess"):
+        return combine_results(stage_results, 1, face_images)
+
+async def analyze_image_data(image_data: bytes, face_images: bool = True) -> Dict[str, Any]:
+    with timed("preprocess"):
+        processed_image = process_image(image_data)
+    if "error" in processed_image:
+        return processed_image
+
+    if PIPELINE_MODE == "fused":
+        stage_results = await run_fused(processed_image)
+    else:
+        stage_results = await run_distributed(processed_image)
+    if "error" in stage_results:
+        return stage_results
 
+    with timed("postprocess"):
+        return combine_results(stage_results, processed_image.get("scale", 1), face_images)
+
+def combine_results(stage_results: Dict[str, Any], scale: float, face_images: bool = True) -> Dict[str, Any]:
+    # boxes arrive clipped to the decoded image by whichever stage cropped them; only returned faces are counted,
+    # so the fused and distributed pipelines answer with the same JSON
+    face_detection_result = stage_results["face_detection"]
+    # downstream functions skip faces they fail on, so every stage is looked up by face_id instead of assumed complete
+    genders = {result["face_id"]: result["gender_result"] for result in stage_results["gender_detection"].get("gender_results", [])}
+    emotions = {result["face_id"]: result["emotion_result"] for result in stage_results["emotion_detection"].get("emotion_results", [])}
+    
     combined_results = {
-        "num_faces_detected": face_detection_result["num_faces_detected"],
+        "num_faces_detected": len(face_detection_result["faces"]),
         "faces": []
     }
     
-    for face_id in range(1, face_detection_result["num_faces_detected"] + 1):
+    for face in face_detection_result["faces"]:
+        face_id = face["face_id"]
         face_info = {
             "face_id": face_id,
-            "bounding_box": next(face["bounding_box"] for face in face_detection_result["faces"] if face["face_id"] == face_id),
-            "detection_confidence": next(face["confidence"] for face in face_detection_result["faces"] if face["face_id"] == face_id),
-            "gender": next(result["gender_result"]["predicted_gender"] for result in gender_detection_result["gender_results"] if result["face_id"] == face_id),
-            "gender_confidence": next(result["gender_result"]["gender_confidence"] for result in gender_detection_result["gender_results"] if result["face_id"] == face_id),
-            "emotion": next(result["emotion_result"]["predicted_emotion"] for result in emotion_detection_result["emotion_results"] if result["face_id"] == face_id),
-            "emotion_confidence": next(result["emotion_result"]["emotion_confidence"] for result in emotion_detection_result["emotion_results"] if result["face_id"] == face_id),
-            "emotion_probabilities": next(result["emotion_result"]["emotion_probabilities"] for result in emotion_detection_result["emotion_results"] if result["face_id"] == face_id),
-            "face_image": next(face["face_image"] for face in face_detection_result["faces"] if face["face_id"] == face_id)
+            "bounding_box": scale_box(face["bounding_box"], scale),
+            "detection_confidence": face["confidence"]
         }
+        gender, emotion = genders.get(face_id), emotions.get(face_id)
+        if gender is not None:
+            face_info["gender"] = gender["predicted_gender"]
+            face_info["gender_confidence"] = gender["gender_confidence"]
+        if emotion is not None:
+            face_info["emotion"] = emotion["predicted_emotion"]
+            face_info["emotion_confidence"] = emotion["emotion_confidence"]
+            face_info["emotion_probabilities"] = emotion["emotion_probabilities"]
+        missing = [stage for stage, result in (("gender", gender), ("emotion", emotion)) if result is None]
+        if missing:
+            face_info["partial"] = True
+            face_info["missing"] = missing
+            combined_results["partial"] = True
+        if face_images:
+            face_info["face_image"] = encode_face_image(face["face_image"])
         combined_results["faces"].append(face_info)
-        
-    set_cached_result(cache_key, combined_results)    
+    
+    return combined_results
+
+def without_face_images(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {**result, "faces": [{k: v for k, v in face.items() if k != "face_image"} for face in result.get("faces", [])]}
+
+async def face_analysis_workflow(image_data: bytes, face_images: bool = True) -> Dict[str, Any]:
+    logger.info(f"face_analysis_workflow received data of length: {len(image_data)} bytes")
+    
+    with timed("cache_lookup"):
+        cache_key = generate_cache_key(image_data)
+        cached_result = await get_cached_result(cache_key)
+    # an entry stored without crops (CACHE_STORE_FACE_IMAGES=false) cannot answer a request that wants them,
+    # so it is recomputed; the stage caches still spare most of the work
+    if cached_result and face_images and not all("face_image" in face for face in cached_result.get("faces", [])):
+        logger.info("Cached result has no face crops, recomputing it")
+        cached_result = None
+    if cached_result:
+        logger.info("Returning cached result")
+        # a cached answer still counts as a request with that many faces
+        FACES_PER_REQUEST.observe(cached_result["num_faces_detected"])
+        return cached_result if face_images else without_face_images(cached_result)
+    
+    # crops are only encoded when the response or the result cache keeps them
+    combined_results = await analyze_image_data(image_data, face_images or CACHE_STORE_FACE_IMAGES)
+    if "error" in combined_results:
+        return combined_results
+    FACES_PER_REQUEST.observe(combined_results["num_faces_detected"])
+    
+    # a result with faces missing gender or emotion is answered but not cached, so the next request retries them
+    if not combined_results.get("partial"):
+        await set_cached_result(cache_key, combined_results)
     
     logger.info("Face analysis workflow completed successfully")
-    return combined_results
\ No newline at end of file
+    return combined_results if face_images else without_face_images(combined_results)
\ No newline at end of file